@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Startup and first-call latency benchmark for the iCloud Email MCP server.
+
+Spawns `python server.py` over stdio the way an MCP client does and reports:
+
+- import: wall time of `import server` in a fresh interpreter
+- initialize: time from spawning the server until the MCP handshake completes
+- first_call: latency of the first get_email_folders call after the handshake
+- startup_seconds: the server's own startup milestones from get_server_info
+
+Each scenario runs with and without background pre-warming (ICLOUD_PREWARM).
+Credentials are taken from the environment as for the server itself.
+
+Usage: python bench.py [--runs N]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import pathlib
+import argparse
+import subprocess
+import statistics
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+def measure_import() -> float:
+    """Seconds taken by `import server` in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        cwd=os.path.dirname(SERVER), capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+async def measure_session(prewarm: bool) -> dict:
+    """Time the MCP handshake and first tool call of a freshly spawned server"""
+    from fastmcp import Client
+    from fastmcp.client.transports import PythonStdioTransport
+    
+    env = dict(os.environ, ICLOUD_PREWARM="1" if prewarm else "0", PYTHONWARNINGS="ignore")
+    transport = PythonStdioTransport(SERVER, env=env, python_cmd=sys.executable, keep_alive=False, log_file=pathlib.Path(os.devnull))
+    
+    started = time.perf_counter()
+    async with Client(transport) as client:
+        initialized = time.perf_counter()
+        await client.call_tool("get_email_folders", {})
+        first_call = time.perf_counter()
+        info = await client.call_tool("get_server_info", {})
+    
+    return {
+        "initialize": initialized - started,
+        "first_call": first_call - initialized,
+        "startup_seconds": json.loads(info.content[0].text).get("startup_seconds", {})
+    }
+
+def summarize(samples: list) -> str:
+    """Format the median and range of a list of durations in milliseconds"""
+    return f"median {statistics.median(samples) * 1000:.0f}ms (min {min(samples) * 1000:.0f}ms, max {max(samples) * 1000:.0f}ms)"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Repetitions per scenario")
+    args = parser.parse_args()
+    
+    imports = [measure_import() for _ in range(args.runs)]
+    print(f"import server: {summarize(imports)}")
+    
+    for prewarm in (False, True):
+        sessions = [asyncio.run(measure_session(prewarm)) for _ in range(args.runs)]
+        label = "prewarm" if prewarm else "no prewarm"
+        print(f"[{label}] initialize: {summarize([s['initialize'] for s in sessions])}")
+        print(f"[{label}] first get_email_folders: {summarize([s['first_call'] for s in sessions])}")
+        print(f"[{label}] last startup milestones: {sessions[-1]['startup_seconds']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,56 @@
 #!/usr/bin/env python3
 
+import time
+
+# Measured from here: startup timings are reported by get_server_info
+_PROCESS_START = time.perf_counter()
+
 import os
+import re
+import sys
+import json
 import imaplib
-import smtplib
 import email
+import email.utils
 import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.header import decode_header
+import hashlib
+import heapq
+import importlib
+import itertools
+import random
+import calendar
+import threading
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from email.header import decode_header, make_header
 from typing import List, Dict, Any, Optional
 
-from fastmcp import FastMCP
+class _LazyModule:
+    """Module proxy that imports the module on first attribute access.
+    
+    Modules needed only by some tools (sending, export/import, fan-out) are loaded
+    this way so they stay off the startup path.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attribute: str) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+base64 = _LazyModule("base64")
+mailbox = _LazyModule("mailbox")
+mimetypes = _LazyModule("mimetypes")
+smtplib = _LazyModule("smtplib")
+sqlite3 = _LazyModule("sqlite3")
+concurrent_futures = _LazyModule("concurrent.futures")
+mime_text = _LazyModule("email.mime.text")
+mime_multipart = _LazyModule("email.mime.multipart")
+mime_application = _LazyModule("email.mime.application")
 
 # iCloud Email Configuration from environment variables
 IMAP_SERVER = "imap.mail.me.com"
@@ -18,243 +58,808 @@ IMAP_PORT = 993
 SMTP_SERVER = "smtp.mail.me.com"
 SMTP_PORT = 587
 
-# Get credentials from environment variables
-USERNAME = os.getenv("ICLOUD_USERNAME", "your.email@icloud.com")
-APP_PASSWORD = os.getenv("ICLOUD_APP_PASSWORD", "your-app-specific-password")
+# Accounts served by this process. ICLOUD_ACCOUNTS lists account names; the credentials
+# of each are read from ICLOUD_USERNAME_<NAME> and ICLOUD_APP_PASSWORD_<NAME>. Without it
+# a single "default" account uses ICLOUD_USERNAME and ICLOUD_APP_PASSWORD.
+# ICLOUD_DEFAULT_ACCOUNT picks the account used when a tool call names none.
+def _load_accounts() -> Any:
+    """Read account names, credentials and the default account from environment variables.
+    
+    Exits with a message naming the variables to fix when an account has no credentials
+    or the default account is not one of the configured accounts.
+    """
+    names = [name.strip() for name in os.getenv("ICLOUD_ACCOUNTS", "").split(",") if name.strip()]
+    if not names:
+        accounts = {
+            "default": {
+                "username": os.getenv("ICLOUD_USERNAME", "your.email@icloud.com"),
+                "app_password": os.getenv("ICLOUD_APP_PASSWORD", "your-app-specific-password")
+            }
+        }
+    else:
+        accounts = {}
+        missing = []
+        for name in names:
+            suffix = re.sub(r'[^A-Za-z0-9]', '_', name).upper()
+            credentials = {}
+            for key, variable in (("username", f"ICLOUD_USERNAME_{suffix}"), ("app_password", f"ICLOUD_APP_PASSWORD_{suffix}")):
+                credentials[key] = os.getenv(variable, "")
+                if not credentials[key]:
+                    missing.append(variable)
+            accounts[name] = credentials
+        if missing:
+            raise SystemExit(f"Configuration error: ICLOUD_ACCOUNTS lists accounts without credentials, set {', '.join(missing)}")
+    
+    default_account = os.getenv("ICLOUD_DEFAULT_ACCOUNT") or next(iter(accounts))
+    if default_account not in accounts:
+        raise SystemExit(
+            f"Configuration error: ICLOUD_DEFAULT_ACCOUNT '{default_account}' is not a configured account, "
+            f"use one of: {', '.join(accounts)}"
+        )
+    return accounts, default_account
 
-# Initialize MCP server
-mcp = FastMCP("iCloud Email Server (STDIO Working)")
+ACCOUNTS, DEFAULT_ACCOUNT = _load_accounts()
+
+# Per-account connection pool and limits. POOL_SIZE also caps the number of concurrent
+# IMAP/SMTP sessions the account's scheduler lets through.
+POOL_SIZE = int(os.getenv("ICLOUD_POOL_SIZE", "2"))
+LOGINS_PER_MINUTE = int(os.getenv("ICLOUD_LOGINS_PER_MINUTE", "10"))
+COMMANDS_PER_SECOND = float(os.getenv("ICLOUD_COMMANDS_PER_SECOND", "10"))
+FOLDER_CACHE_TTL = int(os.getenv("ICLOUD_FOLDER_CACHE_TTL", "300"))
+
+# Scheduling priorities, lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Share of the command rate that bulk work leaves free for interactive commands
+INTERACTIVE_RESERVE = 0.2
+
+# Backoff after iCloud signals throttling, doubled on every consecutive throttle
+THROTTLE_RETRIES = 3
+THROTTLE_BASE_BACKOFF = 2.0
+THROTTLE_MAX_BACKOFF = 120.0
+
+# Idle pooled connections are checked with NOOP after this many seconds and dropped
+# before iCloud's own inactivity logout
+IDLE_CHECK_SECONDS = 60
+IDLE_MAX_SECONDS = 25 * 60
+
+# Local state such as the header index is kept below this directory, one subdirectory per account
+DATA_DIR = os.getenv("ICLOUD_DATA_DIR", os.path.expanduser("~/.icloud-mcp"))
+
+# Bulk transfer settings: messages per FETCH/APPEND batch and the byte budget per batch
+BATCH_SIZE = int(os.getenv("ICLOUD_BATCH_SIZE", "100"))
+BATCH_MAX_BYTES = int(os.getenv("ICLOUD_BATCH_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Offline mode: "auto" serves reads from the local store and queues changes when iCloud is
+# unreachable, "always" never connects to iCloud, "off" disables the local store
+OFFLINE_MODE = os.getenv("ICLOUD_OFFLINE", "auto").lower()
+
+# Number of most recent messages per folder whose bodies sync_offline keeps locally
+OFFLINE_MAX_MESSAGES = int(os.getenv("ICLOUD_OFFLINE_MAX_MESSAGES", "500"))
+
+# After iCloud turned out to be unreachable, serve from the offline store this many seconds
+# before trying to connect again, instead of spending a login attempt on every tool call
+OFFLINE_RETRY_SECONDS = float(os.getenv("ICLOUD_OFFLINE_RETRY_SECONDS", "30"))
+
+# Log in and load the folder list of every account in the background while the server starts
+PREWARM = os.getenv("ICLOUD_PREWARM", "1") != "0"
+
+# Seconds since process start at which startup milestones were reached
+STARTUP_TIMES: Dict[str, float] = {}
+
+# Set once every function of this module is defined; the pre-warm thread starts earlier
+_MODULE_READY = threading.Event()
+
+class RateLimiter:
+    """Token bucket allowing `rate` operations per `period` seconds"""
+    
+    def __init__(self, rate: int, period: float):
+        self.capacity = max(1, rate)
+        self.refill_per_second = self.capacity / period
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+# Response texts iCloud uses when it throttles a client
+_THROTTLE_MARKERS = ("[UNAVAILABLE]", "[LIMIT]", "[INUSE]", "TOO MANY", "THROTTL", "TRY AGAIN LATER", "RATE LIMIT")
+
+# IMAP commands that are safe to repeat after a throttled NO response
+_RETRYABLE_COMMANDS = {"SELECT", "EXAMINE", "LIST", "LSUB", "STATUS", "NOOP", "CAPABILITY", "SEARCH", "FETCH"}
+
+def _is_throttle_response(data) -> bool:
+    """Check whether the text of an IMAP response signals throttling"""
+    text = b" ".join(item if isinstance(item, bytes) else str(item).encode() for item in data or [] if item)
+    return any(marker.encode() in text.upper() for marker in _THROTTLE_MARKERS)
+
+def _is_throttle_error(error: Exception) -> bool:
+    """Check whether an exception looks like iCloud refusing or dropping a busy client"""
+    # An IMAP abort is only throttling when its text says so, connections also drop
+    # for plain network reasons or after sitting idle
+    if isinstance(error, (ConnectionRefusedError, ConnectionResetError)):
+        return True
+    # SMTP errors can only occur once smtplib has been loaded
+    if "smtplib" in sys.modules:
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code in (421, 450, 451, 454):
+            return True
+    text = str(error).upper()
+    return any(marker in text for marker in _THROTTLE_MARKERS)
+
+class RequestScheduler:
+    """Priority queue and adaptive limits for all IMAP and SMTP work of one account.
+    
+    Sessions wait for a slot in priority order, so interactive reads overtake queued
+    bulk work, and every IMAP command takes a token from a rate limiter in which bulk
+    work leaves a reserve for interactive commands. Both the concurrency limit and the
+    command rate follow AIMD: they grow additively while commands succeed and are
+    halved, with an exponential pause, whenever iCloud signals throttling.
+    """
+    
+    def __init__(self, max_concurrency: int = POOL_SIZE, max_command_rate: float = COMMANDS_PER_SECOND):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_command_rate = max(1.0, max_command_rate)
+        self.concurrency = 1.0
+        self.command_rate = self.max_command_rate
+        self.tokens = self.command_rate
+        self.tokens_updated = time.monotonic()
+        self.active = 0
+        self.active_bulk = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.resume_at = 0.0
+        self.backoff = 0.0
+        self.session_successes = 0
+        self.command_successes = 0
+        self.throttle_events = 0
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE):
+        """Hold one of the account's concurrent session slots for the duration of the block"""
+        ticket = (priority, next(self.sequence))
+        bulk = priority != PRIORITY_INTERACTIVE
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                delay = self.resume_at - time.monotonic()
+                # Bulk work never takes the last slot, so an interactive call does not
+                # have to wait for a long bulk session to finish
+                bulk_limit = max(1, int(self.concurrency) - 1)
+                if (self.waiting[0] == ticket and self.active < int(self.concurrency) and delay <= 0
+                        and (not bulk or self.active_bulk < bulk_limit)):
+                    break
+                self.condition.wait(timeout=delay if delay > 0 else None)
+            heapq.heappop(self.waiting)
+            self.active += 1
+            if bulk:
+                self.active_bulk += 1
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                if bulk:
+                    self.active_bulk -= 1
+                self.condition.notify_all()
+    
+    def acquire_command(self, priority: int = PRIORITY_INTERACTIVE):
+        """Wait until the command rate limit and any throttling pause allow another command"""
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                self.tokens = min(self.command_rate, self.tokens + (now - self.tokens_updated) * self.command_rate)
+                self.tokens_updated = now
+                
+                needed = 1.0
+                if priority != PRIORITY_INTERACTIVE:
+                    # The bucket never holds more than command_rate tokens, so the reserve
+                    # must fit below that or bulk commands could never be sent
+                    needed = min(needed + self.command_rate * INTERACTIVE_RESERVE, self.command_rate)
+                
+                pause = self.resume_at - now
+                if pause <= 0 and self.tokens >= needed:
+                    self.tokens -= 1
+                    return
+                delay = max(pause, (needed - self.tokens) / self.command_rate)
+            time.sleep(delay)
+    
+    def on_success(self):
+        """Additive increase: after a window of successful commands allow a little more"""
+        with self.condition:
+            self.backoff = 0.0
+            self.session_successes += 1
+            self.command_successes += 1
+            # One more session per few successes per current session, one more command
+            # per second for roughly every second of commands without throttling
+            if self.session_successes >= 4 * int(self.concurrency):
+                self.session_successes = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.condition.notify_all()
+            if self.command_successes >= self.command_rate:
+                self.command_successes = 0
+                self.command_rate = min(self.max_command_rate, self.command_rate + 1)
+    
+    def on_throttle(self):
+        """Multiplicative decrease and an exponential, jittered pause for all new work"""
+        with self.condition:
+            self.throttle_events += 1
+            self.session_successes = 0
+            self.command_successes = 0
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.command_rate = max(1.0, self.command_rate / 2)
+            self.tokens = min(self.tokens, self.command_rate)
+            self.backoff = min(THROTTLE_MAX_BACKOFF, self.backoff * 2 if self.backoff else THROTTLE_BASE_BACKOFF)
+            self.resume_at = max(self.resume_at, time.monotonic() + self.backoff * random.uniform(1.0, 1.5))
+    
+    def wait_until_resumed(self):
+        """Sleep through a throttling pause"""
+        with self.condition:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def call(self, func, retries: int = THROTTLE_RETRIES) -> Any:
+        """Run func, backing off and retrying while iCloud signals throttling"""
+        for attempt in range(retries + 1):
+            self.wait_until_resumed()
+            try:
+                result = func()
+            except Exception as e:
+                throttled = _is_throttle_error(e)
+                # Connections report throttled responses themselves, count each signal once
+                if throttled and not getattr(e, "throttle_reported", False):
+                    self.on_throttle()
+                if attempt < retries and throttled:
+                    continue
+                raise
+            self.on_success()
+            return result
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current limits and queue state"""
+        with self.condition:
+            return {
+                "concurrency_limit": int(self.concurrency),
+                "command_rate": round(self.command_rate, 1),
+                "active_sessions": self.active,
+                "queued_sessions": len(self.waiting),
+                "throttle_events": self.throttle_events,
+                "paused_seconds": round(max(0.0, self.resume_at - time.monotonic()), 1)
+            }
+
+class ScheduledIMAP4_SSL(imaplib.IMAP4_SSL):
+    """IMAP4_SSL connection whose commands go through an account's RequestScheduler"""
+    
+    scheduler = None
+    priority = PRIORITY_INTERACTIVE
+    
+    def _command(self, name, *args):
+        if self.scheduler is not None:
+            self.scheduler.acquire_command(self.priority)
+        return super()._command(name, *args)
+    
+    def login(self, user, password):
+        try:
+            return super().login(user, password)
+        except imaplib.IMAP4.error as e:
+            # A throttled NO was already reported when _simple_command received it
+            if self.scheduler is not None and _is_throttle_error(e):
+                e.throttle_reported = True
+            raise
+    
+    def _simple_command(self, name, *args):
+        if self.scheduler is None:
+            return super()._simple_command(name, *args)
+        
+        command = str(args[0]).upper() if name == 'UID' and args else name
+        attempt = 0
+        while True:
+            try:
+                typ, data = super()._simple_command(name, *args)
+            except imaplib.IMAP4.abort as e:
+                # BYE or a dropped connection, the pool discards this connection
+                if _is_throttle_error(e):
+                    self.scheduler.on_throttle()
+                    e.throttle_reported = True
+                raise
+            
+            if typ == 'NO' and _is_throttle_response(data):
+                self.scheduler.on_throttle()
+                if command in _RETRYABLE_COMMANDS and attempt < THROTTLE_RETRIES:
+                    attempt += 1
+                    self.scheduler.wait_until_resumed()
+                    continue
+            else:
+                self.scheduler.on_success()
+            return typ, data
+
+class IMAPUnavailable(Exception):
+    """Raised when no connection to the iCloud IMAP server can be established"""
+
+# Errors after which reads are served from the offline store
+_OFFLINE_ERRORS = (IMAPUnavailable, OSError, imaplib.IMAP4.abort)
 
 class EmailManager:
-    def __init__(self):
-        self.imap_connection = None
-        self.smtp_connection = None
+    """Connection pool, caches and rate limits for a single iCloud account"""
+    
+    def __init__(self, name: str, username: str, app_password: str, pool_size: int = POOL_SIZE):
+        self.name = name
+        self.username = username
+        self.app_password = app_password
+        self.scheduler = RequestScheduler(pool_size, COMMANDS_PER_SECOND)
+        self.idle_connections = []
+        self.login_limiter = RateLimiter(LOGINS_PER_MINUTE, 60)
+        self.folder_cache = None
+        self.header_index = None
+        self.offline_store = None
+        self.replay_lock = threading.Lock()
+        self.unreachable_until = 0.0
+        self.lock = threading.Lock()
+    
+    def _open_imap(self):
+        self.login_limiter.acquire()
+        context = ssl.create_default_context()
+        connection = ScheduledIMAP4_SSL(IMAP_SERVER, IMAP_PORT, ssl_context=context)
+        connection.scheduler = self.scheduler
+        try:
+            connection.login(self.username, self.app_password)
+        except imaplib.IMAP4.error:
+            _logout_quietly(connection)
+            raise
+        
+        # Capabilities can change after authentication, so refresh them
+        typ, data = connection.capability()
+        if typ == 'OK' and data and data[0]:
+            connection.capabilities = tuple(data[0].decode().upper().split())
+        return connection
+    
+    def _open_smtp(self):
+        self.login_limiter.acquire()
+        connection = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        try:
+            connection.starttls()
+            connection.login(self.username, self.app_password)
+        except Exception:
+            connection.close()
+            raise
+        return connection
     
     def connect_imap(self):
-        """Connect to iCloud IMAP server"""
+        """Open and authenticate a new connection to the iCloud IMAP server"""
+        if OFFLINE_MODE == "always":
+            raise IMAPUnavailable("IMAP connection failed: offline mode is enabled (ICLOUD_OFFLINE=always)")
+        retry_in = self.unreachable_until - time.monotonic()
+        if retry_in > 0:
+            raise IMAPUnavailable(f"IMAP connection failed: iCloud was unreachable, retrying in {retry_in:.0f}s")
         try:
-            context = ssl.create_default_context()
-            self.imap_connection = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT, ssl_context=context)
-            self.imap_connection.login(USERNAME, APP_PASSWORD)
-            return True
+            connection = self.scheduler.call(self._open_imap)
         except Exception as e:
+            # Network failures and an overloaded iCloud mean the server cannot be reached,
+            # anything else (e.g. rejected credentials) is a real error
+            if isinstance(e, (OSError, imaplib.IMAP4.abort)) or _is_throttle_error(e):
+                # Only worth it with synced folders to serve instead; the offline store
+                # is defined further down and not available to the pre-warm thread
+                if OFFLINE_MODE != "off" and _MODULE_READY.is_set() and self.get_offline_store().has_folder():
+                    self.unreachable_until = time.monotonic() + OFFLINE_RETRY_SECONDS
+                raise IMAPUnavailable(f"IMAP connection failed: {str(e)}")
             raise Exception(f"IMAP connection failed: {str(e)}")
+        
+        # A new connection may mean iCloud is back after an outage. The pre-warm thread can
+        # get here before the replay code is defined and triggers the replay itself instead.
+        if _MODULE_READY.is_set():
+            _start_offline_replay(self)
+        return connection
     
     def connect_smtp(self):
-        """Connect to iCloud SMTP server"""
+        """Open and authenticate a new connection to the iCloud SMTP server"""
         try:
-            self.smtp_connection = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            self.smtp_connection.starttls()
-            self.smtp_connection.login(USERNAME, APP_PASSWORD)
-            return True
+            return self.scheduler.call(self._open_smtp)
         except Exception as e:
             raise Exception(f"SMTP connection failed: {str(e)}")
     
-    def disconnect(self):
-        """Disconnect from email servers"""
-        if self.imap_connection:
+    def _checkout_imap(self):
+        """Take a healthy idle connection from the pool or open a new one"""
+        while True:
+            with self.lock:
+                if not self.idle_connections:
+                    break
+                connection, last_used = self.idle_connections.pop()
+            
+            idle_seconds = time.monotonic() - last_used
+            if idle_seconds > IDLE_MAX_SECONDS:
+                _logout_quietly(connection)
+                continue
+            if idle_seconds > IDLE_CHECK_SECONDS:
+                # A connection that died while idle says nothing about throttling, so the
+                # check only takes a command token and skips the scheduler's accounting
+                scheduler, connection.scheduler = connection.scheduler, None
+                try:
+                    self.scheduler.acquire_command()
+                    connection.noop()
+                except Exception:
+                    _logout_quietly(connection)
+                    continue
+                finally:
+                    connection.scheduler = scheduler
+            return connection
+        
+        return self.connect_imap()
+    
+    @contextmanager
+    def imap(self, priority: int = PRIORITY_INTERACTIVE):
+        """Borrow an authenticated IMAP connection from the account's pool.
+        
+        The session waits for a scheduler slot first; bulk operations should pass
+        PRIORITY_BULK so interactive tools are served ahead of them.
+        """
+        with self.scheduler.slot(priority):
+            connection = None
             try:
-                self.imap_connection.logout()
-            except:
-                pass
-        if self.smtp_connection:
+                connection = self._checkout_imap()
+                connection.priority = priority
+                yield connection
+            except (imaplib.IMAP4.abort, OSError):
+                # The connection is broken, do not hand it out again
+                _logout_quietly(connection)
+                connection = None
+                raise
+            finally:
+                if connection is not None:
+                    with self.lock:
+                        self.idle_connections.append((connection, time.monotonic()))
+    
+    @contextmanager
+    def smtp(self, priority: int = PRIORITY_INTERACTIVE):
+        """Open an authenticated SMTP connection for the duration of the block"""
+        with self.scheduler.slot(priority):
+            connection = self.connect_smtp()
             try:
-                self.smtp_connection.quit()
-            except:
-                pass
+                yield connection
+            except Exception as e:
+                if _is_throttle_error(e):
+                    self.scheduler.on_throttle()
+                raise
+            finally:
+                try:
+                    connection.quit()
+                except:
+                    pass
+    
+    def list_folders(self, imap, refresh: bool = False) -> List[str]:
+        """Return the account's folder names, served from cache for FOLDER_CACHE_TTL seconds"""
+        with self.lock:
+            cached = self.folder_cache
+        if cached and not refresh and time.monotonic() - cached[0] < FOLDER_CACHE_TTL:
+            return list(cached[1])
+        
+        typ, folders = imap.list()
+        folder_list = []
+        
+        for folder in folders:
+            if folder:
+                # Handle both bytes and string folder names
+                if isinstance(folder, bytes):
+                    folder_str = folder.decode()
+                else:
+                    folder_str = str(folder)
+                folder_name = folder_str.split(' "/" ')[-1].strip('"')
+                folder_list.append(folder_name)
+        
+        with self.lock:
+            self.folder_cache = (time.monotonic(), folder_list)
+        return list(folder_list)
+    
+    def get_header_index(self) -> "HeaderIndex":
+        """Return the account's header index, loading it from disk on first use"""
+        with self.lock:
+            if self.header_index is None:
+                self.header_index = HeaderIndex(os.path.join(DATA_DIR, self.name, "header_index"))
+            return self.header_index
+    
+    def get_offline_store(self) -> "OfflineStore":
+        """Return the account's offline store, opening it on first use"""
+        with self.lock:
+            if self.offline_store is None:
+                self.offline_store = OfflineStore(os.path.join(DATA_DIR, self.name, "offline.db"))
+            return self.offline_store
+    
+    def invalidate_folders(self):
+        """Drop the cached folder list after folders were created or removed"""
+        with self.lock:
+            self.folder_cache = None
+    
+    def disconnect(self):
+        """Log out all idle pooled connections"""
+        with self.lock:
+            connections = [connection for connection, _ in self.idle_connections]
+            self.idle_connections = []
+        for connection in connections:
+            _logout_quietly(connection)
+
+def _logout_quietly(connection):
+    """Log out of an IMAP connection, ignoring errors from dead sockets"""
+    if connection is None:
+        return
+    try:
+        connection.logout()
+    except:
+        pass
+
+email_managers = {
+    name: EmailManager(name, credentials["username"], credentials["app_password"])
+    for name, credentials in ACCOUNTS.items()
+}
+
+def _get_manager(account: Optional[str] = None) -> EmailManager:
+    """Return the EmailManager of an account, defaulting to DEFAULT_ACCOUNT"""
+    name = account or DEFAULT_ACCOUNT
+    if name not in email_managers:
+        raise Exception(f"Unknown account '{name}'. Configured accounts: {', '.join(email_managers)}")
+    return email_managers[name]
+
+def _for_each_account(func, accounts: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Run func(manager) for several accounts concurrently and collect results by account"""
+    names = accounts or list(email_managers)
+    managers = {name: _get_manager(name) for name in names}
+    with concurrent_futures.ThreadPoolExecutor(max_workers=len(managers)) as executor:
+        futures = {name: executor.submit(func, manager) for name, manager in managers.items()}
+    
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = {"error": str(e)}
+    return results
 
-email_manager = EmailManager()
+def _mark_startup(milestone: str):
+    """Record the time since process start at which a startup milestone was reached"""
+    STARTUP_TIMES[milestone] = round(time.perf_counter() - _PROCESS_START, 3)
+
+def _prewarm_account(manager: EmailManager):
+    """Open a pooled IMAP connection and fill the folder cache of one account"""
+    with manager.imap() as imap:
+        manager.list_folders(imap, refresh=True)
+
+def _prewarm():
+    """Warm every account's connection pool so the first tool call skips TLS and LOGIN"""
+    for name, result in _for_each_account(_prewarm_account).items():
+        if isinstance(result, dict) and "error" in result:
+            print(f"Prewarm of account '{name}' failed: {result['error']}", file=sys.stderr)
+    _mark_startup("prewarm_done")
+    
+    # Replaying offline changes needs code defined after the FastMCP import
+    _MODULE_READY.wait()
+    for manager in email_managers.values():
+        _start_offline_replay(manager)
+
+_mark_startup("config_loaded")
+
+# Logins only need the configuration above, so they overlap the slow FastMCP import below
+if __name__ == "__main__" and PREWARM and email_managers:
+    threading.Thread(target=_prewarm, name="prewarm", daemon=True).start()
+
+from fastmcp import FastMCP
+
+_mark_startup("fastmcp_imported")
+
+# Initialize MCP server
+mcp = FastMCP("iCloud Email Server (STDIO Working)")
 
 @mcp.tool()
-def get_server_info() -> Dict[str, str]:
+def get_server_info() -> Dict[str, Any]:
     """Get server information and configuration"""
     return {
         "server_name": "iCloud Email Server (STDIO Working)",
-        "username": USERNAME,
+        "username": email_managers[DEFAULT_ACCOUNT].username,
+        "accounts": {name: manager.username for name, manager in email_managers.items()},
+        "default_account": DEFAULT_ACCOUNT,
         "imap_server": f"{IMAP_SERVER}:{IMAP_PORT}",
         "smtp_server": f"{SMTP_SERVER}:{SMTP_PORT}",
+        "startup_seconds": dict(STARTUP_TIMES),
         "version": "1.0.0-stdio-working"
     }
 
 @mcp.tool()
-def test_email_connection() -> Dict[str, str]:
+def list_accounts() -> List[Dict[str, Any]]:
+    """List the iCloud accounts served by this server with their current request limits"""
+    return [
+        {
+            "account": name,
+            "username": manager.username,
+            "default": name == DEFAULT_ACCOUNT,
+            "scheduler": manager.scheduler.stats()
+        }
+        for name, manager in email_managers.items()
+    ]
+
+@mcp.tool()
+def test_email_connection(account: Optional[str] = None) -> Dict[str, str]:
     """Test the email server connection"""
     try:
-        email_manager.connect_imap()
-        email_manager.disconnect()
-        return {"status": "success", "message": "Email connection test successful"}
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            imap.noop()
+        return {"status": "success", "message": f"Email connection test successful for {manager.username}"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
-def get_email_folders() -> List[str]:
+def get_email_folders(account: Optional[str] = None) -> List[str]:
     """Get list of email folders/mailboxes"""
     try:
-        email_manager.connect_imap()
-        typ, folders = email_manager.imap_connection.list()
-        folder_list = []
-        
-        for folder in folders:
-            if folder:
-                # Handle both bytes and string folder names
-                if isinstance(folder, bytes):
-                    folder_str = folder.decode()
-                else:
-                    folder_str = str(folder)
-                folder_name = folder_str.split(' "/" ')[-1].strip('"')
-                folder_list.append(folder_name)
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            return manager.list_folders(imap)
         
-        email_manager.disconnect()
-        return folder_list
+    except _OFFLINE_ERRORS as e:
+        store = _offline_store(manager)
+        if store is None:
+            return [f"Error: {str(e)}"]
+        return store.folder_names()
         
     except Exception as e:
         return [f"Error: {str(e)}"]
 
-@mcp.tool()
-def read_emails(folder: str = "INBOX", limit: int = 5, full_content: bool = False) -> List[Dict[str, Any]]:
-    """Read emails from specified folder. Set full_content=True to get complete email bodies without truncation."""
+def _email_summary(email_id: str, raw: Any, is_unread: bool, full_content: bool = False) -> Optional[Dict[str, Any]]:
+    """Format a raw message for email listings, or return None if it has no valid content"""
+    if isinstance(raw, bytes) and len(raw) > 10:  # Ensure we have actual content
+        email_message = email.message_from_bytes(raw)
+    else:
+        return None
+    
+    # Decode subject with proper error handling
+    subject = "No Subject"
+    if email_message["Subject"]:
+        try:
+            decoded_header = decode_header(email_message["Subject"])
+            if decoded_header and decoded_header[0][0]:
+                subject = decoded_header[0][0]
+                if isinstance(subject, bytes):
+                    subject = subject.decode()
+        except:
+            subject = str(email_message["Subject"])
+    
+    # Get email content with robust handling
+    body = ""
     try:
-        email_manager.connect_imap()
-        
+        if email_message.is_multipart():
+            for part in email_message.walk():
+                if part.get_content_type() == "text/plain":
+                    try:
+                        payload = part.get_payload(decode=True)
+                        if payload is None:
+                            continue
+                        elif isinstance(payload, bytes):
+                            body = payload.decode('utf-8', errors='ignore')
+                        elif isinstance(payload, str):
+                            body = payload
+                        else:
+                            body = str(payload)
+                        break
+                    except:
+                        continue
+        else:
+            try:
+                payload = email_message.get_payload(decode=True)
+                if payload is None:
+                    body = "Empty message"
+                elif isinstance(payload, bytes):
+                    body = payload.decode('utf-8', errors='ignore')
+                elif isinstance(payload, str):
+                    body = payload
+                else:
+                    body = str(payload)
+            except:
+                body = "Could not decode message"
+    except:
+        body = "Error processing message content"
+    
+    return {
+        "id": email_id,
+        "from": email_message.get("From", "Unknown"),
+        "to": email_message.get("To", "Unknown"),
+        "subject": subject,
+        "date": email_message.get("Date", "Unknown"),
+        "body": body if full_content else (body[:200] + "..." if len(body) > 200 else body),
+        "unread": is_unread
+    }
+
+def _read_emails_online(manager: EmailManager, folder: str, limit: int, full_content: bool) -> List[Dict[str, Any]]:
+    """Read the most recent emails of a folder from iCloud"""
+    with manager.imap() as imap:
         # Quote folder name if it contains spaces or special characters
         quoted_folder = _quote_folder_name(folder)
-        
+    
         # Select folder
-        typ, select_result = email_manager.imap_connection.select(quoted_folder)
+        typ, select_result = imap.select(quoted_folder)
         if typ != 'OK':
             return [{"error": f"Failed to select folder '{folder}'"}]
-        
+    
         # Search for all emails
-        typ, messages = email_manager.imap_connection.search(None, 'ALL')
+        typ, messages = imap.search(None, 'ALL')
         if not messages[0]:
             return []
-            
-        email_ids = messages[0].split()
         
+        email_ids = messages[0].split()
+    
         # Get recent emails (limited by limit parameter)
         recent_emails = email_ids[-limit:] if len(email_ids) > limit else email_ids
-        
+    
         emails = []
         for email_id in reversed(recent_emails):
+            # Handle email_id for display
+            display_id = email_id.decode('utf-8', errors='ignore') if isinstance(email_id, bytes) else str(email_id)
             try:
-                # Decode email_id and use BODY.PEEK[] to preserve read status
-                fetch_id = email_id.decode() if isinstance(email_id, bytes) else str(email_id)
-                typ, msg_data = email_manager.imap_connection.fetch(fetch_id, '(FLAGS BODY.PEEK[])')
+                # Use BODY.PEEK[] to preserve read status
+                typ, msg_data = imap.fetch(display_id, '(FLAGS BODY.PEEK[])')
                 if msg_data and len(msg_data) > 0 and isinstance(msg_data[0], tuple) and len(msg_data[0]) > 1:
-                    
-                    # Extract flags and email body from response  
+                    # Extract flags and email body from response
                     flags_info = msg_data[0][0] if msg_data[0][0] else b''
-                    is_unread = b'\\Seen' not in flags_info
-                    
-                    email_body = msg_data[0][1]
-                    if isinstance(email_body, bytes) and len(email_body) > 10:  # Ensure we have actual content
-                        email_message = email.message_from_bytes(email_body)
-                    else:
-                        continue  # Skip this email if no valid content
-                    
-                    # Decode subject with proper error handling
-                    subject = "No Subject"
-                    if email_message["Subject"]:
-                        try:
-                            decoded_header = decode_header(email_message["Subject"])
-                            if decoded_header and decoded_header[0][0]:
-                                subject = decoded_header[0][0]
-                                if isinstance(subject, bytes):
-                                    subject = subject.decode()
-                        except:
-                            subject = str(email_message["Subject"])
-                    
-                    # Get email content with robust handling
-                    body = ""
-                    try:
-                        if email_message.is_multipart():
-                            for part in email_message.walk():
-                                if part.get_content_type() == "text/plain":
-                                    try:
-                                        payload = part.get_payload(decode=True)
-                                        if payload is None:
-                                            continue
-                                        elif isinstance(payload, bytes):
-                                            body = payload.decode('utf-8', errors='ignore')
-                                        elif isinstance(payload, str):
-                                            body = payload
-                                        else:
-                                            body = str(payload)
-                                        break
-                                    except:
-                                        continue
-                        else:
-                            try:
-                                payload = email_message.get_payload(decode=True)
-                                if payload is None:
-                                    body = "Empty message"
-                                elif isinstance(payload, bytes):
-                                    body = payload.decode('utf-8', errors='ignore')
-                                elif isinstance(payload, str):
-                                    body = payload
-                                else:
-                                    body = str(payload)
-                            except:
-                                body = "Could not decode message"
-                    except:
-                        body = "Error processing message content"
-                    
-                    # Handle email_id for display
-                    display_id = email_id
-                    if isinstance(email_id, bytes):
-                        display_id = email_id.decode('utf-8', errors='ignore')
-                    else:
-                        display_id = str(email_id)
-                    
-                    emails.append({
-                        "id": display_id,
-                        "from": email_message.get("From", "Unknown"),
-                        "to": email_message.get("To", "Unknown"),
-                        "subject": subject,
-                        "date": email_message.get("Date", "Unknown"),
-                        "body": body if full_content else (body[:200] + "..." if len(body) > 200 else body),
-                        "unread": is_unread
-                    })
+                    summary = _email_summary(display_id, msg_data[0][1], b'\\Seen' not in flags_info, full_content)
+                    if summary:
+                        emails.append(summary)
             except Exception as e:
-                # Handle email_id for error display
-                display_id = email_id
-                if isinstance(email_id, bytes):
-                    display_id = email_id.decode('utf-8', errors='ignore')
-                else:
-                    display_id = str(email_id)
                 emails.append({"error": f"Error reading email {display_id}: {str(e)}"})
-        
-        email_manager.disconnect()
-        return emails
-        
+    
+    return emails
+
+@mcp.tool()
+def read_emails(folder: str = "INBOX", limit: int = 5, full_content: bool = False, account: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Read emails from specified folder. Set full_content=True to get complete email bodies without truncation."""
+    try:
+        manager = _get_manager(account)
+        return _read_emails_online(manager, folder, limit, full_content)
+    
+    except _OFFLINE_ERRORS as e:
+        store = _offline_store(manager, folder)
+        if store is None:
+            return [{"error": str(e)}]
+        return _read_emails_offline(store, folder, limit, full_content)
+    
     except Exception as e:
         return [{"error": str(e)}]
 
 @mcp.tool()
-def send_email(to: str, subject: str, body: str, cc: Optional[str] = None) -> Dict[str, str]:
+def send_email(to: str, subject: str, body: str, cc: Optional[str] = None, account: Optional[str] = None) -> Dict[str, str]:
     """Send an email"""
     try:
-        email_manager.connect_smtp()
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = USERNAME
-        msg['To'] = to
-        msg['Subject'] = subject
+        manager = _get_manager(account)
+        with manager.smtp() as smtp:
+            # Create message
+            msg = mime_multipart.MIMEMultipart()
+            msg['From'] = manager.username
+            msg['To'] = to
+            msg['Subject'] = subject
         
-        if cc:
-            msg['Cc'] = cc
+            if cc:
+                msg['Cc'] = cc
         
-        # Add body to email
-        msg.attach(MIMEText(body, 'plain'))
+            # Add body to email
+            msg.attach(mime_text.MIMEText(body, 'plain'))
         
-        # Send email
-        recipients = [to]
-        if cc:
-            recipients.extend([addr.strip() for addr in cc.split(',')])
+            # Send email
+            recipients = [to]
+            if cc:
+                recipients.extend([addr.strip() for addr in cc.split(',')])
         
-        email_manager.smtp_connection.send_message(msg, to_addrs=recipients)
-        email_manager.disconnect()
+            smtp.send_message(msg, to_addrs=recipients)
         
         return {"status": "success", "message": f"Email sent to {to}"}
         
@@ -267,7 +872,8 @@ def send_email_with_attachments(
     subject: str, 
     body: str, 
     cc: Optional[str] = None,
-    attachments: Optional[List[Dict[str, str]]] = None
+    attachments: Optional[List[Dict[str, str]]] = None,
+    account: Optional[str] = None
 ) -> Dict[str, str]:
     """Send an email with optional attachments.
     
@@ -280,72 +886,66 @@ def send_email_with_attachments(
             - 'content': Base64-encoded file content
             - 'filename': Name of the file
             - 'content_type': MIME type (optional, will be guessed if not provided)
+        account: Account to send from (optional, defaults to the default account)
     
     Example attachment format:
     [{"content": "base64_encoded_data", "filename": "document.pdf", "content_type": "application/pdf"}]
     """
     try:
-        import base64
-        import mimetypes
-        from email.mime.base import MIMEBase
-        from email.mime.application import MIMEApplication
-        from email import encoders
-        
-        email_manager.connect_smtp()
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = USERNAME
-        msg['To'] = to
-        msg['Subject'] = subject
-        
-        if cc:
-            msg['Cc'] = cc
-        
-        # Add body to email
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Process attachments if provided
-        if attachments:
-            for attachment in attachments:
-                if not attachment.get('content') or not attachment.get('filename'):
-                    continue
+        manager = _get_manager(account)
+        with manager.smtp() as smtp:
+            # Create message
+            msg = mime_multipart.MIMEMultipart()
+            msg['From'] = manager.username
+            msg['To'] = to
+            msg['Subject'] = subject
+        
+            if cc:
+                msg['Cc'] = cc
+        
+            # Add body to email
+            msg.attach(mime_text.MIMEText(body, 'plain'))
+        
+            # Process attachments if provided
+            if attachments:
+                for attachment in attachments:
+                    if not attachment.get('content') or not attachment.get('filename'):
+                        continue
                     
-                try:
-                    # Decode base64 content
-                    file_data = base64.b64decode(attachment['content'])
-                    filename = attachment['filename']
+                    try:
+                        # Decode base64 content
+                        file_data = base64.b64decode(attachment['content'])
+                        filename = attachment['filename']
                     
-                    # Determine MIME type
-                    content_type = attachment.get('content_type')
-                    if not content_type:
-                        content_type, _ = mimetypes.guess_type(filename)
+                        # Determine MIME type
+                        content_type = attachment.get('content_type')
                         if not content_type:
-                            content_type = 'application/octet-stream'
+                            content_type, _ = mimetypes.guess_type(filename)
+                            if not content_type:
+                                content_type = 'application/octet-stream'
                     
-                    # Create attachment
-                    if content_type.startswith('text/'):
-                        # Text attachment
-                        attachment_part = MIMEText(file_data.decode('utf-8', errors='ignore'))
-                        attachment_part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                    else:
-                        # Binary attachment
-                        attachment_part = MIMEApplication(file_data, _subtype=content_type.split('/')[-1])
-                        attachment_part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+                        # Create attachment
+                        if content_type.startswith('text/'):
+                            # Text attachment
+                            attachment_part = mime_text.MIMEText(file_data.decode('utf-8', errors='ignore'))
+                            attachment_part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+                        else:
+                            # Binary attachment
+                            attachment_part = mime_application.MIMEApplication(file_data, _subtype=content_type.split('/')[-1])
+                            attachment_part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
                     
-                    msg.attach(attachment_part)
+                        msg.attach(attachment_part)
                     
-                except Exception as e:
-                    # Log attachment error but continue with email
-                    print(f"Warning: Could not process attachment {attachment.get('filename', 'unknown')}: {str(e)}")
+                    except Exception as e:
+                        # Log attachment error but continue with email
+                        print(f"Warning: Could not process attachment {attachment.get('filename', 'unknown')}: {str(e)}")
         
-        # Send email
-        recipients = [to]
-        if cc:
-            recipients.extend([addr.strip() for addr in cc.split(',')])
+            # Send email
+            recipients = [to]
+            if cc:
+                recipients.extend([addr.strip() for addr in cc.split(',')])
         
-        email_manager.smtp_connection.send_message(msg, to_addrs=recipients)
-        email_manager.disconnect()
+            smtp.send_message(msg, to_addrs=recipients)
         
         attachment_count = len(attachments) if attachments else 0
         message = f"Email sent to {to}"
@@ -363,7 +963,8 @@ def send_email_with_file_paths(
     subject: str, 
     body: str, 
     cc: Optional[str] = None,
-    file_paths: Optional[List[str]] = None
+    file_paths: Optional[List[str]] = None,
+    account: Optional[str] = None
 ) -> Dict[str, str]:
     """Send an email with attachments from local file paths.
     
@@ -373,14 +974,12 @@ def send_email_with_file_paths(
         body: Email body text
         cc: CC recipients (comma-separated)
         file_paths: List of file paths to attach
+        account: Account to send from (optional, defaults to the default account)
     
     Note: Files must be accessible to the Docker container.
     For Docker usage, files should be in mounted volumes.
     """
     try:
-        import base64
-        import os
-        
         attachments = []
         
         # Convert file paths to base64 attachments
@@ -408,310 +1007,275 @@ def send_email_with_file_paths(
                 except Exception as e:
                     print(f"Warning: Could not process file {file_path}: {str(e)}")
         
-        # Use the existing attachment function
-        return send_email_with_attachments(to, subject, body, cc, attachments)
+        # Use the existing attachment function (the decorator wraps it in a tool object)
+        return send_email_with_attachments.fn(to, subject, body, cc, attachments, account)
         
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
-def mark_email_read(email_id: str, folder: str = "INBOX") -> Dict[str, str]:
+def mark_email_read(email_id: str, folder: str = "INBOX", account: Optional[str] = None) -> Dict[str, str]:
     """Mark a specific email as read"""
     try:
-        email_manager.connect_imap()
-        
-        # Quote folder name if it contains spaces or special characters
-        quoted_folder = _quote_folder_name(folder)
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            # Quote folder name if it contains spaces or special characters
+            quoted_folder = _quote_folder_name(folder)
         
-        # Select folder
-        typ, select_result = email_manager.imap_connection.select(quoted_folder)
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to select folder '{folder}'"}
+            # Select folder
+            typ, select_result = imap.select(quoted_folder)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select folder '{folder}'"}
         
-        # Add the \Seen flag to mark as read
-        typ, store_result = email_manager.imap_connection.store(email_id, '+FLAGS', '\\Seen')
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to mark email {email_id} as read"}
+            # Add the \Seen flag to mark as read
+            typ, store_result = imap.store(email_id, '+FLAGS', '\\Seen')
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to mark email {email_id} as read"}
         
-        email_manager.disconnect()
         return {"status": "success", "message": f"Email {email_id} marked as read"}
         
+    except IMAPUnavailable as e:
+        return _queue_offline(manager, folder, e, f"Email {email_id} marked as read",
+                              lambda store: store.set_flags(folder, email_id, add=['\\Seen']))
+        
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @mcp.tool()
-def mark_email_unread(email_id: str, folder: str = "INBOX") -> Dict[str, str]:
+def mark_email_unread(email_id: str, folder: str = "INBOX", account: Optional[str] = None) -> Dict[str, str]:
     """Mark a specific email as unread"""
     try:
-        email_manager.connect_imap()
-        
-        # Quote folder name if it contains spaces or special characters
-        quoted_folder = _quote_folder_name(folder)
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            # Quote folder name if it contains spaces or special characters
+            quoted_folder = _quote_folder_name(folder)
         
-        # Select folder
-        typ, select_result = email_manager.imap_connection.select(quoted_folder)
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to select folder '{folder}'"}
+            # Select folder
+            typ, select_result = imap.select(quoted_folder)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select folder '{folder}'"}
         
-        # Remove the \Seen flag to mark as unread
-        typ, store_result = email_manager.imap_connection.store(email_id, '-FLAGS', '\\Seen')
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to mark email {email_id} as unread"}
+            # Remove the \Seen flag to mark as unread
+            typ, store_result = imap.store(email_id, '-FLAGS', '\\Seen')
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to mark email {email_id} as unread"}
         
-        email_manager.disconnect()
         return {"status": "success", "message": f"Email {email_id} marked as unread"}
         
+    except IMAPUnavailable as e:
+        return _queue_offline(manager, folder, e, f"Email {email_id} marked as unread",
+                              lambda store: store.set_flags(folder, email_id, remove=['\\Seen']))
+        
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-@mcp.tool()
-def read_full_email(email_id: str, folder: str = "INBOX") -> Dict[str, Any]:
-    """Read the complete content of a specific email without truncation"""
+def _email_details(email_id: str, raw: Any, is_unread: bool, folder: str) -> Dict[str, Any]:
+    """Format the complete content of a raw message for read_full_email"""
+    if not (isinstance(raw, bytes) and len(raw) > 10):
+        return {"error": f"Email {email_id} has no valid content"}
+    
+    email_message = email.message_from_bytes(raw)
+    
+    # Decode subject with proper error handling
+    subject = "No Subject"
+    if email_message["Subject"]:
+        try:
+            decoded_header = decode_header(email_message["Subject"])
+            if decoded_header and decoded_header[0][0]:
+                subject = decoded_header[0][0]
+                if isinstance(subject, bytes):
+                    subject = subject.decode()
+        except:
+            subject = str(email_message["Subject"])
+    
+    # Get FULL email content without truncation
+    body = ""
+    html_body = ""
+    attachments = []
+    
     try:
-        email_manager.connect_imap()
-        
+        if email_message.is_multipart():
+            for part in email_message.walk():
+                content_type = part.get_content_type()
+    
+                if content_type == "text/plain":
+                    try:
+                        payload = part.get_payload(decode=True)
+                        if payload and isinstance(payload, bytes):
+                            body = payload.decode('utf-8', errors='ignore')
+                        elif payload and isinstance(payload, str):
+                            body = payload
+                    except:
+                        continue
+    
+                elif content_type == "text/html":
+                    try:
+                        payload = part.get_payload(decode=True)
+                        if payload and isinstance(payload, bytes):
+                            html_body = payload.decode('utf-8', errors='ignore')
+                        elif payload and isinstance(payload, str):
+                            html_body = payload
+                    except:
+                        continue
+    
+                # Handle attachments
+                elif part.get_content_disposition() and "attachment" in part.get_content_disposition():
+                    filename = part.get_filename()
+                    if filename:
+                        attachments.append({
+                            "filename": filename,
+                            "content_type": content_type,
+                            "size": len(part.get_payload(decode=True)) if part.get_payload(decode=True) else 0
+                        })
+        else:
+            # Single part message
+            try:
+                payload = email_message.get_payload(decode=True)
+                if payload and isinstance(payload, bytes):
+                    body = payload.decode('utf-8', errors='ignore')
+                elif payload and isinstance(payload, str):
+                    body = payload
+            except:
+                body = "Could not decode message"
+    
+    except Exception as e:
+        body = f"Error processing message content: {str(e)}"
+    
+    # Get additional email headers
+    headers = {}
+    for header in ['Message-ID', 'References', 'In-Reply-To', 'Return-Path', 'X-Priority']:
+        if email_message.get(header):
+            headers[header] = email_message.get(header)
+    
+    result = {
+        "id": email_id,
+        "from": email_message.get("From", "Unknown"),
+        "to": email_message.get("To", "Unknown"),
+        "cc": email_message.get("Cc", ""),
+        "bcc": email_message.get("Bcc", ""),
+        "subject": subject,
+        "date": email_message.get("Date", "Unknown"),
+        "body": body,
+        "unread": is_unread,
+        "folder": folder
+    }
+    
+    # Add HTML body if available
+    if html_body:
+        result["html_body"] = html_body
+    
+    # Add attachments if any
+    if attachments:
+        result["attachments"] = attachments
+    
+    # Add additional headers if any
+    if headers:
+        result["headers"] = headers
+    
+    return result
+
+def _read_full_email_online(manager: EmailManager, email_id: str, folder: str) -> Dict[str, Any]:
+    """Read the complete content of one email from iCloud"""
+    with manager.imap() as imap:
         # Quote folder name if it contains spaces or special characters
         quoted_folder = _quote_folder_name(folder)
-        
+    
         # Select folder
-        typ, select_result = email_manager.imap_connection.select(quoted_folder)
+        typ, select_result = imap.select(quoted_folder)
         if typ != 'OK':
             return {"error": f"Failed to select folder '{folder}'"}
-        
+    
         # Fetch the specific email with full content (preserve unread status)
-        typ, msg_data = email_manager.imap_connection.fetch(email_id, '(FLAGS BODY.PEEK[])')
-        
+        typ, msg_data = imap.fetch(email_id, '(FLAGS BODY.PEEK[])')
+    
         if not (msg_data and len(msg_data) > 0 and isinstance(msg_data[0], tuple) and len(msg_data[0]) > 1):
             return {"error": f"Email {email_id} not found or could not be retrieved"}
-        
+    
         # Extract flags and email body
         flags_info = msg_data[0][0] if msg_data[0][0] else b''
         is_unread = b'\\Seen' not in flags_info
-        
-        email_body = msg_data[0][1]
-        if not (isinstance(email_body, bytes) and len(email_body) > 10):
-            return {"error": f"Email {email_id} has no valid content"}
-        
-        email_message = email.message_from_bytes(email_body)
-        
-        # Decode subject with proper error handling
-        subject = "No Subject"
-        if email_message["Subject"]:
-            try:
-                decoded_header = decode_header(email_message["Subject"])
-                if decoded_header and decoded_header[0][0]:
-                    subject = decoded_header[0][0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode()
-            except:
-                subject = str(email_message["Subject"])
-        
-        # Get FULL email content without truncation
-        body = ""
-        html_body = ""
-        attachments = []
-        
-        try:
-            if email_message.is_multipart():
-                for part in email_message.walk():
-                    content_type = part.get_content_type()
-                    
-                    if content_type == "text/plain":
-                        try:
-                            payload = part.get_payload(decode=True)
-                            if payload and isinstance(payload, bytes):
-                                body = payload.decode('utf-8', errors='ignore')
-                            elif payload and isinstance(payload, str):
-                                body = payload
-                        except:
-                            continue
-                    
-                    elif content_type == "text/html":
-                        try:
-                            payload = part.get_payload(decode=True)
-                            if payload and isinstance(payload, bytes):
-                                html_body = payload.decode('utf-8', errors='ignore')
-                            elif payload and isinstance(payload, str):
-                                html_body = payload
-                        except:
-                            continue
-                    
-                    # Handle attachments
-                    elif part.get_content_disposition() and "attachment" in part.get_content_disposition():
-                        filename = part.get_filename()
-                        if filename:
-                            attachments.append({
-                                "filename": filename,
-                                "content_type": content_type,
-                                "size": len(part.get_payload(decode=True)) if part.get_payload(decode=True) else 0
-                            })
-            else:
-                # Single part message
-                try:
-                    payload = email_message.get_payload(decode=True)
-                    if payload and isinstance(payload, bytes):
-                        body = payload.decode('utf-8', errors='ignore')
-                    elif payload and isinstance(payload, str):
-                        body = payload
-                except:
-                    body = "Could not decode message"
-        
-        except Exception as e:
-            body = f"Error processing message content: {str(e)}"
-        
-        # Get additional email headers
-        headers = {}
-        for header in ['Message-ID', 'References', 'In-Reply-To', 'Return-Path', 'X-Priority']:
-            if email_message.get(header):
-                headers[header] = email_message.get(header)
-        
-        email_manager.disconnect()
-        
-        result = {
-            "id": email_id,
-            "from": email_message.get("From", "Unknown"),
-            "to": email_message.get("To", "Unknown"),
-            "cc": email_message.get("Cc", ""),
-            "bcc": email_message.get("Bcc", ""),
-            "subject": subject,
-            "date": email_message.get("Date", "Unknown"),
-            "body": body,
-            "unread": is_unread,
-            "folder": folder
-        }
-        
-        # Add HTML body if available
-        if html_body:
-            result["html_body"] = html_body
-        
-        # Add attachments if any
-        if attachments:
-            result["attachments"] = attachments
-        
-        # Add additional headers if any
-        if headers:
-            result["headers"] = headers
-        
-        return result
-        
-    except Exception as e:
-        return {"error": f"Failed to read email {email_id}: {str(e)}"}
+    
+    return _email_details(email_id, msg_data[0][1], is_unread, folder)
 
 @mcp.tool()
-def get_unread_emails(folder: str = "INBOX", limit: int = 10) -> List[Dict[str, Any]]:
-    """Read only unread emails from specified folder"""
+def read_full_email(email_id: str, folder: str = "INBOX", account: Optional[str] = None) -> Dict[str, Any]:
+    """Read the complete content of a specific email without truncation"""
     try:
-        email_manager.connect_imap()
-        
+        manager = _get_manager(account)
+        return _read_full_email_online(manager, email_id, folder)
+    
+    except _OFFLINE_ERRORS as e:
+        store = _offline_store(manager, folder)
+        if store is None:
+            return {"error": f"Failed to read email {email_id}: {str(e)}"}
+        return _read_full_email_offline(store, email_id, folder)
+    
+    except Exception as e:
+        return {"error": f"Failed to read email {email_id}: {str(e)}"}
+
+def _get_unread_emails_online(manager: EmailManager, folder: str, limit: int) -> List[Dict[str, Any]]:
+    """Read only unread emails from a folder of one account on iCloud"""
+    with manager.imap() as imap:
         # Quote folder name if it contains spaces or special characters
         quoted_folder = _quote_folder_name(folder)
-        
+    
         # Select folder
-        typ, select_result = email_manager.imap_connection.select(quoted_folder)
+        typ, select_result = imap.select(quoted_folder)
         if typ != 'OK':
             return [{"error": f"Failed to select folder '{folder}'"}]
-        
+    
         # Search for unread emails only
-        typ, messages = email_manager.imap_connection.search(None, 'UNSEEN')
+        typ, messages = imap.search(None, 'UNSEEN')
         if not messages[0]:
             return []
-            
-        email_ids = messages[0].split()
         
+        email_ids = messages[0].split()
+    
         # Get recent unread emails (limited by limit parameter)
         recent_emails = email_ids[-limit:] if len(email_ids) > limit else email_ids
-        
+    
         emails = []
         for email_id in reversed(recent_emails):
+            # Handle email_id for display
+            display_id = email_id.decode('utf-8', errors='ignore') if isinstance(email_id, bytes) else str(email_id)
             try:
-                # Decode email_id and use BODY.PEEK[] to preserve unread status
-                fetch_id = email_id.decode() if isinstance(email_id, bytes) else str(email_id)
-                typ, msg_data = email_manager.imap_connection.fetch(fetch_id, '(FLAGS BODY.PEEK[])')
+                # Use BODY.PEEK[] to preserve unread status
+                typ, msg_data = imap.fetch(display_id, '(FLAGS BODY.PEEK[])')
                 if msg_data and len(msg_data) > 0 and isinstance(msg_data[0], tuple) and len(msg_data[0]) > 1:
-                    email_body = msg_data[0][1]
-                    if isinstance(email_body, bytes) and len(email_body) > 10:
-                        email_message = email.message_from_bytes(email_body)
-                    else:
-                        continue
-                    
-                    # Decode subject with proper error handling
-                    subject = "No Subject"
-                    if email_message["Subject"]:
-                        try:
-                            decoded_header = decode_header(email_message["Subject"])
-                            if decoded_header and decoded_header[0][0]:
-                                subject = decoded_header[0][0]
-                                if isinstance(subject, bytes):
-                                    subject = subject.decode()
-                        except:
-                            subject = str(email_message["Subject"])
-                    
-                    # Get email content with robust handling
-                    body = ""
-                    try:
-                        if email_message.is_multipart():
-                            for part in email_message.walk():
-                                if part.get_content_type() == "text/plain":
-                                    try:
-                                        payload = part.get_payload(decode=True)
-                                        if payload is None:
-                                            continue
-                                        elif isinstance(payload, bytes):
-                                            body = payload.decode('utf-8', errors='ignore')
-                                        elif isinstance(payload, str):
-                                            body = payload
-                                        else:
-                                            body = str(payload)
-                                        break
-                                    except:
-                                        continue
-                        else:
-                            try:
-                                payload = email_message.get_payload(decode=True)
-                                if payload is None:
-                                    body = "Empty message"
-                                elif isinstance(payload, bytes):
-                                    body = payload.decode('utf-8', errors='ignore')
-                                elif isinstance(payload, str):
-                                    body = payload
-                                else:
-                                    body = str(payload)
-                            except:
-                                body = "Could not decode message"
-                    except:
-                        body = "Error processing message content"
-                    
-                    # Handle email_id for display
-                    display_id = email_id
-                    if isinstance(email_id, bytes):
-                        display_id = email_id.decode('utf-8', errors='ignore')
-                    else:
-                        display_id = str(email_id)
-                    
-                    emails.append({
-                        "id": display_id,
-                        "from": email_message.get("From", "Unknown"),
-                        "to": email_message.get("To", "Unknown"),
-                        "subject": subject,
-                        "date": email_message.get("Date", "Unknown"),
-                        "body": body[:200] + "..." if len(body) > 200 else body,
-                        "unread": True  # Mark as unread for clarity
-                    })
+                    summary = _email_summary(display_id, msg_data[0][1], True)
+                    if summary:
+                        emails.append(summary)
             except Exception as e:
-                # Handle email_id for error display
-                display_id = email_id
-                if isinstance(email_id, bytes):
-                    display_id = email_id.decode('utf-8', errors='ignore')
-                else:
-                    display_id = str(email_id)
                 emails.append({"error": f"Error reading email {display_id}: {str(e)}"})
-        
-        email_manager.disconnect()
-        return emails
-        
+    
+    return emails
+
+def _get_unread_emails(manager: EmailManager, folder: str, limit: int) -> List[Dict[str, Any]]:
+    """Read only unread emails from a folder of one account, from the offline store if iCloud is unreachable"""
+    try:
+        return _get_unread_emails_online(manager, folder, limit)
+    except _OFFLINE_ERRORS:
+        store = _offline_store(manager, folder)
+        if store is None:
+            raise
+        return _get_unread_emails_offline(store, folder, limit)
+
+@mcp.tool()
+def get_unread_emails(folder: str = "INBOX", limit: int = 10, account: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Read only unread emails from specified folder"""
+    try:
+        return _get_unread_emails(_get_manager(account), folder, limit)
     except Exception as e:
         return [{"error": str(e)}]
 
+@mcp.tool()
+def get_unread_emails_all_accounts(folder: str = "INBOX", limit: int = 10) -> Dict[str, Any]:
+    """Read unread emails from the same folder of every configured account.
+    
+    The accounts are queried concurrently and the results are keyed by account name.
+    """
+    return _for_each_account(lambda manager: _get_unread_emails(manager, folder, limit))
+
 def _quote_folder_name(folder_name: str) -> str:
     """Quote folder names that contain spaces or special characters for IMAP commands"""
     if ' ' in folder_name or '"' in folder_name or any(c in folder_name for c in ['(', ')', '{', '}', '%', '*']):
@@ -721,79 +1285,81 @@ def _quote_folder_name(folder_name: str) -> str:
     return folder_name
 
 @mcp.tool()
-def move_email(email_id: str, source_folder: str, destination_folder: str) -> Dict[str, str]:
+def move_email(email_id: str, source_folder: str, destination_folder: str, account: Optional[str] = None) -> Dict[str, str]:
     """Move a single email from one folder to another"""
     try:
-        email_manager.connect_imap()
-        
-        # Quote folder names if they contain spaces or special characters
-        quoted_source = _quote_folder_name(source_folder)
-        quoted_destination = _quote_folder_name(destination_folder)
-        
-        # Select source folder
-        typ, select_result = email_manager.imap_connection.select(quoted_source)
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to select source folder '{source_folder}'"}
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            # Quote folder names if they contain spaces or special characters
+            quoted_source = _quote_folder_name(source_folder)
+            quoted_destination = _quote_folder_name(destination_folder)
+        
+            # Select source folder
+            typ, select_result = imap.select(quoted_source)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select source folder '{source_folder}'"}
+        
+            # Copy the email to destination folder
+            typ, copy_result = imap.copy(email_id, quoted_destination)
+            if typ != 'OK':
+                error_msg = copy_result[0].decode() if copy_result and copy_result[0] else "Unknown error"
+                return {"status": "error", "message": f"Failed to copy email {email_id} to {destination_folder}: {error_msg}"}
+        
+            # Mark the original email as deleted
+            typ, store_result = imap.store(email_id, '+FLAGS', '\\Deleted')
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to mark email {email_id} for deletion"}
+        
+            # Expunge to actually remove the email from source folder
+            imap.expunge()
         
-        # Copy the email to destination folder
-        typ, copy_result = email_manager.imap_connection.copy(email_id, quoted_destination)
-        if typ != 'OK':
-            error_msg = copy_result[0].decode() if copy_result and copy_result[0] else "Unknown error"
-            return {"status": "error", "message": f"Failed to copy email {email_id} to {destination_folder}: {error_msg}"}
-        
-        # Mark the original email as deleted
-        typ, store_result = email_manager.imap_connection.store(email_id, '+FLAGS', '\\Deleted')
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to mark email {email_id} for deletion"}
-        
-        # Expunge to actually remove the email from source folder
-        email_manager.imap_connection.expunge()
-        
-        email_manager.disconnect()
         return {"status": "success", "message": f"Email {email_id} moved from {source_folder} to {destination_folder}"}
         
+    except IMAPUnavailable as e:
+        return _queue_offline(manager, source_folder, e, f"Email {email_id} moved from {source_folder} to {destination_folder}",
+                              lambda store: store.move(source_folder, email_id, destination_folder))
+        
     except Exception as e:
         return {"status": "error", "message": f"Failed to move email: {str(e)}"}
 
 @mcp.tool()
-def move_emails(email_ids: List[str], source_folder: str, destination_folder: str) -> Dict[str, Any]:
+def move_emails(email_ids: List[str], source_folder: str, destination_folder: str, account: Optional[str] = None) -> Dict[str, Any]:
     """Move multiple emails from one folder to another"""
     try:
-        email_manager.connect_imap()
+        manager = _get_manager(account)
+        with manager.imap(PRIORITY_BULK) as imap:
+            # Quote folder names if they contain spaces or special characters
+            quoted_source = _quote_folder_name(source_folder)
+            quoted_destination = _quote_folder_name(destination_folder)
         
-        # Quote folder names if they contain spaces or special characters
-        quoted_source = _quote_folder_name(source_folder)
-        quoted_destination = _quote_folder_name(destination_folder)
+            # Select source folder
+            typ, select_result = imap.select(quoted_source)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select source folder '{source_folder}'"}
         
-        # Select source folder
-        typ, select_result = email_manager.imap_connection.select(quoted_source)
-        if typ != 'OK':
-            return {"status": "error", "message": f"Failed to select source folder '{source_folder}'"}
+            moved_count = 0
+            failed_emails = []
         
-        moved_count = 0
-        failed_emails = []
-        
-        for email_id in email_ids:
-            try:
-                # Copy the email to destination folder
-                typ, copy_result = email_manager.imap_connection.copy(email_id, quoted_destination)
-                if typ == 'OK':
-                    # Mark the original email as deleted
-                    typ_store, store_result = email_manager.imap_connection.store(email_id, '+FLAGS', '\\Deleted')
-                    if typ_store == 'OK':
-                        moved_count += 1
+            for email_id in email_ids:
+                try:
+                    # Copy the email to destination folder
+                    typ, copy_result = imap.copy(email_id, quoted_destination)
+                    if typ == 'OK':
+                        # Mark the original email as deleted
+                        typ_store, store_result = imap.store(email_id, '+FLAGS', '\\Deleted')
+                        if typ_store == 'OK':
+                            moved_count += 1
+                        else:
+                            failed_emails.append(email_id)
                     else:
                         failed_emails.append(email_id)
-                else:
+                except Exception as e:
                     failed_emails.append(email_id)
-            except Exception as e:
-                failed_emails.append(email_id)
         
-        # Expunge to actually remove the emails from source folder
-        if moved_count > 0:
-            email_manager.imap_connection.expunge()
+            # Expunge to actually remove the emails from source folder
+            if moved_count > 0:
+                imap.expunge()
         
-        email_manager.disconnect()
         
         result = {
             "status": "success" if moved_count > 0 else "error",
@@ -807,46 +1373,1938 @@ def move_emails(email_ids: List[str], source_folder: str, destination_folder: st
             
         return result
         
+    except IMAPUnavailable as e:
+        result = _queue_offline(manager, source_folder, e, f"Moved {len(email_ids)} emails from {source_folder} to {destination_folder}",
+                                lambda store: store.move(source_folder, ",".join(email_ids), destination_folder))
+        if result["status"] == "success":
+            result["moved_count"] = len(email_ids)
+            result["total_emails"] = len(email_ids)
+        return result
+        
     except Exception as e:
         return {"status": "error", "message": f"Failed to move emails: {str(e)}"}
 
 @mcp.tool()
-def create_folder(folder_name: str, parent_folder: Optional[str] = None) -> Dict[str, str]:
+def create_folder(folder_name: str, parent_folder: Optional[str] = None, account: Optional[str] = None) -> Dict[str, str]:
     """Create a new email folder/mailbox
     
     Args:
         folder_name: Name of the folder to create
         parent_folder: Parent folder path (optional). If specified, creates subfolder.
+        account: Account to create the folder in (optional, defaults to the default account)
     """
     try:
-        email_manager.connect_imap()
+        manager = _get_manager(account)
+        with manager.imap() as imap:
+            # Construct the full folder path
+            if parent_folder:
+                # Use the IMAP folder separator (usually '.' for iCloud)
+                full_folder_path = f"{parent_folder}.{folder_name}"
+            else:
+                full_folder_path = folder_name
         
-        # Construct the full folder path
-        if parent_folder:
-            # Use the IMAP folder separator (usually '.' for iCloud)
-            full_folder_path = f"{parent_folder}.{folder_name}"
-        else:
-            full_folder_path = folder_name
+            # Create the folder
+            typ, result = imap.create(full_folder_path)
+        
+            if typ != 'OK':
+                error_msg = result[0].decode() if result and result[0] else "Unknown error"
+                return {"status": "error", "message": f"Failed to create folder '{full_folder_path}': {error_msg}"}
         
-        # Create the folder
-        typ, result = email_manager.imap_connection.create(full_folder_path)
+            # Subscribe to the folder to make it visible in most email clients
+            try:
+                imap.subscribe(full_folder_path)
+            except:
+                # Subscribe may fail on some servers, but folder creation succeeded
+                pass
         
+        manager.invalidate_folders()
+        return {"status": "success", "message": f"Folder '{full_folder_path}' created successfully"}
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to create folder: {str(e)}"}
+
+# IMAP system flags and their single-letter Maildir equivalents
+_IMAP_TO_MAILDIR_FLAGS = {
+    '\\Seen': 'S',
+    '\\Answered': 'R',
+    '\\Flagged': 'F',
+    '\\Deleted': 'T',
+    '\\Draft': 'D',
+}
+
+_FETCH_UID_RE = re.compile(rb'\bUID (\d+)')
+_FETCH_SIZE_RE = re.compile(rb'\bRFC822\.SIZE (\d+)')
+
+def _uid_set(uids: List[int]) -> str:
+    """Compress a list of UIDs into an IMAP sequence set such as '1:5,9,12:14'"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+def _iter_fetch_response(msg_data) -> Any:
+    """Yield (metadata, literal) pairs from an imaplib FETCH response.
+
+    imaplib returns a tuple for every message that carries a literal, followed by the
+    closing part of the response line as plain bytes. Responses without a literal
+    (e.g. FLAGS only) are plain bytes and are yielded with a literal of None.
+    """
+    current = None
+    for item in msg_data or []:
+        if isinstance(item, tuple):
+            if current:
+                yield current[0], current[1]
+            current = [item[0], item[1]]
+        elif isinstance(item, bytes):
+            if current is not None:
+                # Trailing part of the previous message, may hold items sent after the literal
+                yield current[0] + b' ' + item, current[1]
+                current = None
+            elif item.strip():
+                yield item, None
+    if current:
+        yield current[0], current[1]
+
+def _parse_fetch_metadata(meta: bytes) -> Dict[str, Any]:
+    """Extract UID, flags, internal date and size from a FETCH response line"""
+    uid_match = _FETCH_UID_RE.search(meta)
+    size_match = _FETCH_SIZE_RE.search(meta)
+    internaldate = imaplib.Internaldate2tuple(meta)
+    return {
+        "uid": int(uid_match.group(1)) if uid_match else None,
+        "flags": [flag.decode() for flag in imaplib.ParseFlags(meta)],
+        "internaldate": time.mktime(internaldate) if internaldate else None,
+        "size": int(size_match.group(1)) if size_match else None,
+    }
+
+def _get_uidvalidity(imap) -> Optional[int]:
+    """Return the UIDVALIDITY of the currently selected folder"""
+    typ, data = imap.response('UIDVALIDITY')
+    if data and data[0]:
+        return int(data[0])
+    return None
+
+def _search_uids(imap, criteria: str) -> List[int]:
+    """Run a UID SEARCH and return the matching UIDs in ascending order"""
+    typ, data = imap.uid('SEARCH', criteria)
+    if typ != 'OK':
+        raise Exception(f"UID SEARCH {criteria} failed")
+    if not data or not data[0]:
+        return []
+    return sorted(int(uid) for uid in data[0].split())
+
+def _uid_fetch(imap, uids: List[int], items: str, chunk_size: int = 1000) -> Any:
+    """UID FETCH small items for many UIDs, yielding (metadata, literal) pairs.
+
+    UIDs are sent in chunks so sparse UID sets do not produce overly long command lines.
+    """
+    for start in range(0, len(uids), chunk_size):
+        typ, msg_data = imap.uid('FETCH', _uid_set(uids[start:start + chunk_size]), items)
         if typ != 'OK':
-            error_msg = result[0].decode() if result and result[0] else "Unknown error"
-            return {"status": "error", "message": f"Failed to create folder '{full_folder_path}': {error_msg}"}
+            raise Exception(f"Failed to fetch {items}")
+        yield from _iter_fetch_response(msg_data)
+
+def _fetch_sizes(imap, uids: List[int]) -> Dict[int, int]:
+    """Fetch RFC822.SIZE for the given UIDs without downloading any content"""
+    sizes = {}
+    for meta, _ in _uid_fetch(imap, uids, '(UID RFC822.SIZE)'):
+        info = _parse_fetch_metadata(meta)
+        if info["uid"] is not None:
+            sizes[info["uid"]] = info["size"] or 0
+    return sizes
+
+def _normalize_message_id(message_id: str) -> str:
+    """Normalize a Message-ID header value for duplicate detection"""
+    return "".join(str(message_id).split())
+
+def _duplicate_key(headers: "email.message.Message") -> Any:
+    """Identify a message by its Message-ID, or by a hash of its headers if it has none"""
+    message_id = headers.get("Message-ID")
+    if message_id:
+        return _normalize_message_id(message_id)
+    return _header_hash(headers)
+
+def _fetch_duplicate_keys(imap, uids: List[int]) -> set:
+    """Collect the duplicate keys of the given UIDs using header-only fetches"""
+    keys = set()
+    for meta, header in _uid_fetch(imap, uids, f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(_DUPLICATE_HEADERS)})])"):
+        if header is not None:
+            keys.add(_duplicate_key(email.message_from_bytes(header)))
+    return keys
+
+# Headers mbox readers add to store flags, and the quoting of body lines starting with "From "
+_MBOX_STATUS_HEADER_RE = re.compile(rb'^(?:X-)?Status:[^\n]*\n(?:[ \t][^\n]*\n)*', re.IGNORECASE | re.MULTILINE)
+_MBOX_FROM_QUOTE_RE = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+def _strip_mbox_artifacts(raw: bytes) -> bytes:
+    """Remove the Status/X-Status headers and >From quoting an mbox adds to a message"""
+    separator = re.search(rb'\r?\n\r?\n', raw)
+    split = separator.end() if separator else len(raw)
+    return _MBOX_STATUS_HEADER_RE.sub(b'', raw[:split]) + _MBOX_FROM_QUOTE_RE.sub(rb'\1', raw[split:])
+
+def _pack_batches(uids: List[int], sizes: Dict[int, int], batch_size: int) -> Any:
+    """Group UIDs into batches bounded by message count and BATCH_MAX_BYTES"""
+    batch = []
+    batch_bytes = 0
+    for uid in uids:
+        size = sizes.get(uid, 0)
+        if batch and (len(batch) >= batch_size or batch_bytes + size > BATCH_MAX_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(uid)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def _load_json(path: str) -> Dict[str, Any]:
+    """Load a JSON state file, returning an empty dict if there is none"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_json(path: str, state: Dict[str, Any]):
+    """Atomically replace a JSON state file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _to_mailbox_message(raw: bytes, info: Dict[str, Any], mailbox_format: str) -> "mailbox.Message":
+    """Wrap a raw message in a mailbox message carrying its IMAP flags and internal date"""
+    message = mailbox.MaildirMessage(raw)
+    message.set_subdir('cur')
+    message.set_flags(''.join(sorted(
+        _IMAP_TO_MAILDIR_FLAGS[flag] for flag in info["flags"] if flag in _IMAP_TO_MAILDIR_FLAGS
+    )))
+    if info["internaldate"]:
+        message.set_date(info["internaldate"])
+    if mailbox_format == "mbox":
+        # mboxMessage converts Maildir flags to Status/X-Status and the date to the From_ line
+        return mailbox.mboxMessage(message)
+    return message
+
+@mcp.tool()
+def export_folder(
+    folder: str,
+    destination: str,
+    mailbox_format: str = "mbox",
+    incremental: bool = True,
+    batch_size: int = BATCH_SIZE,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Export the raw messages of a folder to an mbox file or Maildir directory.
+    
+    Args:
+        folder: Folder to export
+        destination: Path of the mbox file or Maildir directory (e.g. on a mounted volume)
+        mailbox_format: "mbox" or "maildir"
+        incremental: Continue from the previous checkpoint and export only newer messages.
+            Set to False to export the whole folder again, replacing the previous export.
+        batch_size: Maximum number of messages fetched per round trip
+        account: Account to export from (optional, defaults to the default account)
+    
+    Progress is written to "<destination>.checkpoint.json" after every batch, so an
+    interrupted export resumes after the last UID that was written. A destination that
+    holds messages without a checkpoint, or the export of another folder, is refused.
+    """
+    try:
+        if mailbox_format not in ("mbox", "maildir"):
+            return {"status": "error", "message": f"Unsupported format '{mailbox_format}', use 'mbox' or 'maildir'"}
+        
+        manager = _get_manager(account)
+        with manager.imap(PRIORITY_BULK) as imap:
+            # Select read-only so the export never changes flags
+            typ, select_result = imap.select(_quote_folder_name(folder), readonly=True)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select folder '{folder}'"}
+        
+            uidvalidity = _get_uidvalidity(imap)
+            checkpoint_path = f"{destination}.checkpoint.json"
+            checkpoint = _load_json(checkpoint_path)
+            if checkpoint and (checkpoint.get("folder") != folder or checkpoint.get("account", manager.name) != manager.name):
+                return {
+                    "status": "error",
+                    "message": f"{destination} holds the export of folder '{checkpoint.get('folder')}' of account "
+                               f"'{checkpoint.get('account', manager.name)}', choose another destination"
+                }
+        
+            # UIDs are only comparable while UIDVALIDITY is unchanged
+            last_uid = 0
+            exported_total = 0
+            uidvalidity_reset = incremental and bool(checkpoint) and checkpoint.get("uidvalidity") != uidvalidity
+            resume = incremental and bool(checkpoint) and not uidvalidity_reset
+            if resume:
+                last_uid = checkpoint.get("last_uid", 0)
+                exported_total = checkpoint.get("exported_total", 0)
+            elif checkpoint:
+                # Dropped before the old export is cleared, so a crash cannot resume into an emptied mailbox
+                os.remove(checkpoint_path)
+        
+            # "n:*" always matches the highest UID, so filter out anything already exported
+            uids = [uid for uid in _search_uids(imap, f"UID {last_uid + 1}:*") if uid > last_uid]
+        
+            if mailbox_format == "maildir":
+                box = mailbox.Maildir(destination, create=True)
+            else:
+                box = mailbox.mbox(destination, create=True)
+        
+            exported_count = 0
+            box.lock()
+            try:
+                if not resume and len(box):
+                    if not checkpoint:
+                        return {
+                            "status": "error",
+                            "message": f"{destination} already contains messages that were not exported here, choose an empty destination"
+                        }
+                    # Starting over replaces the previous export instead of adding a second copy
+                    box.clear()
+                    box.flush()
+                
+                sizes = _fetch_sizes(imap, uids)
+                for batch in _pack_batches(uids, sizes, max(1, batch_size)):
+                    typ, msg_data = imap.uid('FETCH', _uid_set(batch), '(UID FLAGS INTERNALDATE BODY.PEEK[])')
+                    if typ != 'OK':
+                        raise Exception(f"Failed to fetch UIDs {batch[0]}:{batch[-1]}")
+                
+                    for meta, raw in _iter_fetch_response(msg_data):
+                        if raw is None:
+                            continue
+                        box.add(_to_mailbox_message(raw, _parse_fetch_metadata(meta), mailbox_format))
+                        exported_count += 1
+                
+                    # Persist the batch before advancing the checkpoint past it
+                    box.flush()
+                    last_uid = batch[-1]
+                    _save_json(checkpoint_path, {
+                        "account": manager.name,
+                        "folder": folder,
+                        "format": mailbox_format,
+                        "uidvalidity": uidvalidity,
+                        "last_uid": last_uid,
+                        "exported_total": exported_total + exported_count,
+                        "updated": time.time()
+                    })
+            finally:
+                box.unlock()
+                box.close()
         
-        # Subscribe to the folder to make it visible in most email clients
+        
+        result = {
+            "status": "success",
+            "message": f"Exported {exported_count} emails from {folder} to {destination}",
+            "exported_count": exported_count,
+            "last_uid": last_uid,
+            "checkpoint": checkpoint_path
+        }
+        
+        if uidvalidity_reset:
+            result["warning"] = "Folder UIDVALIDITY changed since the last export, the previous export was replaced"
+        
+        return result
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to export folder: {str(e)}"}
+
+# Maildir flags and the IMAP system flags they are uploaded with
+_MAILDIR_TO_IMAP_FLAGS = {letter: flag for flag, letter in _IMAP_TO_MAILDIR_FLAGS.items()}
+
+def _append_messages(imap, folder: str, batch: List[Any]) -> List[bool]:
+    """Upload (flags, internal date, raw message) tuples and report success per message.
+    
+    With LITERAL+ the messages are sent as non-synchronizing literals, either in one
+    MULTIAPPEND command or as pipelined APPENDs, so the batch costs a single round trip.
+    Without it every message needs its own APPEND with a continuation round trip.
+    """
+    quoted_folder = _quote_folder_name(folder)
+    capabilities = imap.capabilities
+    
+    if 'LITERAL+' not in capabilities:
+        results = []
+        for flags, internaldate, raw in batch:
+            typ, data = imap.append(quoted_folder, flags or None, imaplib.Time2Internaldate(internaldate), raw)
+            results.append(typ == 'OK')
+        return results
+    
+    parts = []
+    for flags, internaldate, raw in batch:
+        literal = imaplib.MapCRLF.sub(imaplib.CRLF, raw)
+        date_time = imaplib.Time2Internaldate(internaldate).encode()
+        parts.append(b'(%s) %s {%d+}\r\n%s' % (flags.encode(), date_time, len(literal), literal))
+    
+    # imaplib only sends synchronizing literals, so the commands are built with the
+    # literals inlined and issued through its low-level tagged command interface
+    if 'MULTIAPPEND' in capabilities:
+        tags = [imap._command('APPEND', quoted_folder, b' '.join(parts))]
+    else:
+        tags = [imap._command('APPEND', quoted_folder, part) for part in parts]
+    
+    statuses = []
+    for tag in tags:
         try:
-            email_manager.imap_connection.subscribe(full_folder_path)
-        except:
-            # Subscribe may fail on some servers, but folder creation succeeded
-            pass
+            typ, data = imap._command_complete('APPEND', tag)
+            statuses.append(typ == 'OK')
+        except imaplib.IMAP4.abort:
+            # The connection is gone, no later APPEND can succeed on it
+            raise
+        except imaplib.IMAP4.error:
+            statuses.append(False)
+    
+    if 'MULTIAPPEND' not in capabilities:
+        return statuses
+    if statuses[0]:
+        return [True] * len(batch)
+    
+    # MULTIAPPEND is all or nothing, retry one by one to isolate the rejected messages
+    return [_append_messages(imap, folder, [item])[0] for item in batch] if len(batch) > 1 else [False]
+
+@mcp.tool()
+def import_messages(
+    source: str,
+    folder: str = "INBOX",
+    mailbox_format: str = "mbox",
+    skip_duplicates: bool = True,
+    batch_size: int = BATCH_SIZE,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Import messages from an mbox file or Maildir directory into a folder.
+    
+    Args:
+        source: Path of the mbox file or Maildir directory (e.g. on a mounted volume)
+        folder: Destination folder, which must already exist
+        mailbox_format: "mbox" or "maildir"
+        skip_duplicates: Skip messages whose Message-ID (or, without one, whose From, To,
+            Cc, Subject and Date) is already in the folder, which makes re-running an
+            interrupted import safe
+        batch_size: Maximum number of messages uploaded per round trip
+        account: Account to import into (optional, defaults to the default account)
+    
+    Flags and internal dates from the source mailbox are preserved. The Status and
+    X-Status headers and >From quoting of mbox files are removed before uploading.
+    """
+    try:
+        if mailbox_format not in ("mbox", "maildir"):
+            return {"status": "error", "message": f"Unsupported format '{mailbox_format}', use 'mbox' or 'maildir'"}
+        if not os.path.exists(source):
+            return {"status": "error", "message": f"Source '{source}' does not exist"}
         
-        email_manager.disconnect()
-        return {"status": "success", "message": f"Folder '{full_folder_path}' created successfully"}
+        if mailbox_format == "maildir":
+            box = mailbox.Maildir(source, create=False)
+        else:
+            box = mailbox.mbox(source, create=False)
+        
+        try:
+            manager = _get_manager(account)
+            with manager.imap(PRIORITY_BULK) as imap:
+                typ, select_result = imap.select(_quote_folder_name(folder), readonly=True)
+                if typ != 'OK':
+                    return {"status": "error", "message": f"Failed to select folder '{folder}'"}
+                
+                # Header-only fetch of the Message-IDs and header hashes already present
+                known_keys = _fetch_duplicate_keys(imap, _search_uids(imap, 'ALL')) if skip_duplicates else set()
+                
+                imported_count = 0
+                skipped_count = 0
+                failed_count = 0
+                total_count = 0
+                batch = []
+                batch_bytes = 0
+                
+                def flush_batch():
+                    nonlocal imported_count, failed_count, batch, batch_bytes
+                    results = _append_messages(imap, folder, batch)
+                    imported_count += sum(results)
+                    failed_count += len(results) - sum(results)
+                    batch = []
+                    batch_bytes = 0
+                
+                for key in box.iterkeys():
+                    total_count += 1
+                    message = box.get_message(key)
+                    if mailbox_format == "mbox":
+                        # Converts Status/X-Status flags and the From_ line date
+                        message = mailbox.MaildirMessage(message)
+                    
+                    if skip_duplicates:
+                        duplicate_key = _duplicate_key(message)
+                        if duplicate_key in known_keys:
+                            skipped_count += 1
+                            continue
+                        known_keys.add(duplicate_key)
+                    
+                    flags = " ".join(sorted(
+                        _MAILDIR_TO_IMAP_FLAGS[letter] for letter in message.get_flags() if letter in _MAILDIR_TO_IMAP_FLAGS
+                    ))
+                    raw = box.get_bytes(key)
+                    if mailbox_format == "mbox":
+                        # The flags are uploaded as IMAP flags, the mbox-only headers are not
+                        raw = _strip_mbox_artifacts(raw)
+                    
+                    if batch and (len(batch) >= max(1, batch_size) or batch_bytes + len(raw) > BATCH_MAX_BYTES):
+                        flush_batch()
+                    batch.append((flags, message.get_date(), raw))
+                    batch_bytes += len(raw)
+                
+                if batch:
+                    flush_batch()
+        finally:
+            box.close()
+        
+        result = {
+            "status": "error" if failed_count and not imported_count else "success",
+            "imported_count": imported_count,
+            "skipped_duplicates": skipped_count,
+            "total_messages": total_count,
+            "message": f"Imported {imported_count} of {total_count} emails into {folder}"
+        }
+        
+        if failed_count:
+            result["failed_count"] = failed_count
+        
+        return result
         
     except Exception as e:
-        return {"status": "error", "message": f"Failed to create folder: {str(e)}"}
+        return {"status": "error", "message": f"Failed to import messages: {str(e)}"}
+
+# IMAP system flags stored as bits in the header index
+_FLAG_BITS = {
+    '\\Seen': 1,
+    '\\Answered': 2,
+    '\\Flagged': 4,
+    '\\Deleted': 8,
+    '\\Draft': 16,
+}
+
+def _flag_bits(flags: List[str]) -> int:
+    """Pack IMAP system flags into a bitmask"""
+    bits = 0
+    for flag in flags:
+        bits |= _FLAG_BITS.get(flag, 0)
+    return bits
+
+# Headers fetched for the index; all but Message-ID form the normalized header hash
+_DUPLICATE_HEADERS = ("FROM", "TO", "CC", "SUBJECT", "DATE", "MESSAGE-ID")
+
+def _hash64(value: str) -> int:
+    """Stable 64-bit hash of a string"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', errors='replace'), digest_size=8).digest(), 'big')
+
+def _header_hash(headers: "email.message.Message") -> int:
+    """Hash of the identifying headers with case and folding whitespace normalized"""
+    parts = []
+    for name in _DUPLICATE_HEADERS[:-1]:
+        value = headers.get(name)
+        parts.append(" ".join(str(value).split()).lower() if value is not None else "")
+    return _hash64("\n".join(parts))
+
+def _parse_date_filter(value: Optional[str]) -> Optional[int]:
+    """Convert a YYYY-MM-DD date into a UTC timestamp"""
+    if not value:
+        return None
+    return calendar.timegm(time.strptime(value, "%Y-%m-%d"))
+
+_STATUS_ITEM_RE = re.compile(rb'([A-Z]+) (\d+)')
+
+def _get_folder_status(imap, quoted_folder: str, items: str) -> Dict[str, int]:
+    """Return the numeric STATUS items of a folder, empty if the command failed"""
+    typ, data = imap.status(quoted_folder, items)
+    if typ != 'OK' or not data or not data[0]:
+        return {}
+    # The item list follows the folder name, which may itself contain parentheses
+    values = data[0].rpartition(b'(')[2].upper()
+    return {name.decode(): int(value) for name, value in _STATUS_ITEM_RE.findall(values)}
+
+class HeaderIndex:
+    """Columnar index of message headers for fast mailbox analytics.
+    
+    Every column is a typed array holding one value per message. Folder names and
+    senders are stored once and referenced by position, which keeps 100k messages at a
+    few megabytes and makes aggregations simple passes over flat arrays.
+    """
+    
+    VERSION = 2
+    COLUMNS = {
+        "folder": 'H',
+        "uid": 'I',
+        "date": 'q',
+        "size": 'I',
+        "sender": 'I',
+        "flags": 'B',
+        "message_id": 'Q',
+        "header_hash": 'Q',
+    }
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.clear()
+        self.load()
+    
+    def __len__(self) -> int:
+        return len(self.columns["uid"])
+    
+    def clear(self):
+        """Reset the index to an empty state"""
+        self.columns = {name: array(code) for name, code in self.COLUMNS.items()}
+        self.folders = []
+        self.folder_state = {}
+        self.senders = []
+        self.sender_ids = {}
+    
+    def load(self):
+        """Load the index from disk, starting empty if it is missing or unreadable"""
+        meta = _load_json(os.path.join(self.path, "meta.json"))
+        if meta.get("version") != self.VERSION:
+            return
+        
+        try:
+            columns = {}
+            for name, code in self.COLUMNS.items():
+                column = array(code)
+                with open(os.path.join(self.path, f"{name}.bin"), 'rb') as f:
+                    column.frombytes(f.read())
+                columns[name] = column
+        except (OSError, ValueError):
+            return
+        
+        # A crash between writing columns and metadata leaves them out of step
+        if any(len(column) != meta.get("rows") for column in columns.values()):
+            return
+        
+        self.columns = columns
+        self.folders = meta["folders"]
+        self.folder_state = meta["folder_state"]
+        self.senders = meta["senders"]
+        self.sender_ids = {sender: position for position, sender in enumerate(self.senders)}
+    
+    def save(self):
+        """Write every column and the metadata to disk"""
+        os.makedirs(self.path, exist_ok=True)
+        for name, column in self.columns.items():
+            column_path = os.path.join(self.path, f"{name}.bin")
+            with open(f"{column_path}.tmp", 'wb') as f:
+                column.tofile(f)
+            os.replace(f"{column_path}.tmp", column_path)
+        
+        _save_json(os.path.join(self.path, "meta.json"), {
+            "version": self.VERSION,
+            "rows": len(self),
+            "folders": self.folders,
+            "folder_state": self.folder_state,
+            "senders": self.senders
+        })
+    
+    def _folder_id(self, folder: str) -> int:
+        if folder not in self.folders:
+            self.folders.append(folder)
+        return self.folders.index(folder)
+    
+    def _sender_id(self, sender: str) -> int:
+        sender_id = self.sender_ids.get(sender)
+        if sender_id is None:
+            sender_id = len(self.senders)
+            self.senders.append(sender)
+            self.sender_ids[sender] = sender_id
+        return sender_id
+    
+    def _keep_rows(self, keep: List[bool]):
+        """Drop every row whose entry in keep is False"""
+        self.columns = {
+            name: array(column.typecode, (value for value, kept in zip(column, keep) if kept))
+            for name, column in self.columns.items()
+        }
+    
+    def _folder_rows(self, folder_id: int) -> Dict[int, int]:
+        """Map UID to row number for the rows of one folder"""
+        uids = self.columns["uid"]
+        return {uids[row]: row for row, value in enumerate(self.columns["folder"]) if value == folder_id}
+    
+    def remove_folder(self, folder: str):
+        """Drop all rows of a folder, e.g. after it was deleted or its UIDVALIDITY changed"""
+        if folder in self.folders:
+            folder_id = self.folders.index(folder)
+            self._keep_rows([value != folder_id for value in self.columns["folder"]])
+        self.folder_state.pop(folder, None)
+    
+    def remove_uids(self, folder: str, uids: List[int]):
+        """Drop the rows of specific messages, e.g. after they were moved elsewhere"""
+        if folder not in self.folders:
+            return
+        folder_id = self.folders.index(folder)
+        removed = set(uids)
+        uid_column = self.columns["uid"]
+        folder_column = self.columns["folder"]
+        self._keep_rows([
+            folder_column[row] != folder_id or uid_column[row] not in removed for row in range(len(self))
+        ])
+    
+    def refresh_folder(self, imap, folder: str) -> int:
+        """Bring one folder up to date and return the number of newly indexed messages.
+        
+        Only messages above the folder's last indexed UID have their headers fetched.
+        Expunged messages are dropped and flags of known messages are refreshed with a
+        single FLAGS fetch. With CONDSTORE an unchanged folder costs one STATUS command
+        and only flags changed since the last refresh are fetched.
+        """
+        quoted_folder = _quote_folder_name(folder)
+        state = self.folder_state.get(folder)
+        
+        # Read the mod-sequence before the flags so changes made meanwhile are fetched next time
+        status = {}
+        if 'CONDSTORE' in imap.capabilities:
+            status = _get_folder_status(imap, quoted_folder, '(MESSAGES UIDVALIDITY HIGHESTMODSEQ)')
+        highestmodseq = status.get("HIGHESTMODSEQ")
+        if (state and highestmodseq is not None and state.get("highestmodseq") == highestmodseq
+                and state["uidvalidity"] == status.get("UIDVALIDITY") and state.get("messages") == status.get("MESSAGES")):
+            # New messages and flag changes raise HIGHESTMODSEQ, expunges lower MESSAGES
+            return 0
+        
+        typ, select_result = imap.select(quoted_folder, readonly=True)
+        if typ != 'OK':
+            # Folders such as \Noselect parents cannot be indexed
+            return 0
+        
+        uidvalidity = _get_uidvalidity(imap)
+        if state and state["uidvalidity"] != uidvalidity:
+            self.remove_folder(folder)
+            state = None
+        
+        folder_id = self._folder_id(folder)
+        current_uids = _search_uids(imap, 'ALL')
+        indexed = self._folder_rows(folder_id)
+        
+        current = set(current_uids)
+        if any(uid not in current for uid in indexed):
+            uid_column = self.columns["uid"]
+            folder_column = self.columns["folder"]
+            self._keep_rows([
+                folder_column[row] != folder_id or uid_column[row] in current for row in range(len(self))
+            ])
+            indexed = self._folder_rows(folder_id)
+        
+        # Flags of messages that were already indexed may have changed since
+        if indexed:
+            items = '(UID FLAGS)'
+            if highestmodseq is not None and state and state.get("highestmodseq"):
+                items = f'(UID FLAGS) (CHANGEDSINCE {state["highestmodseq"]})'
+            flags_column = self.columns["flags"]
+            typ, msg_data = imap.uid('FETCH', f"1:{max(indexed)}", items)
+            if typ == 'OK':
+                for meta, _ in _iter_fetch_response(msg_data):
+                    info = _parse_fetch_metadata(meta)
+                    row = indexed.get(info["uid"])
+                    if row is not None:
+                        flags_column[row] = _flag_bits(info["flags"])
+        
+        new_uids = [uid for uid in current_uids if uid not in indexed]
+        items = f"(UID FLAGS INTERNALDATE RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({' '.join(_DUPLICATE_HEADERS)})])"
+        added = 0
+        for meta, header in _uid_fetch(imap, new_uids, items):
+            info = _parse_fetch_metadata(meta)
+            if info["uid"] is None:
+                continue
+            headers = email.message_from_bytes(header or b'')
+            name, address = email.utils.parseaddr(headers.get("From", ""))
+            sender = address.lower() or name
+            message_id = headers.get("Message-ID")
+            
+            self.columns["folder"].append(folder_id)
+            self.columns["uid"].append(info["uid"])
+            self.columns["date"].append(int(info["internaldate"] or 0))
+            self.columns["size"].append(info["size"] or 0)
+            self.columns["sender"].append(self._sender_id(sender))
+            self.columns["flags"].append(_flag_bits(info["flags"]))
+            self.columns["message_id"].append(_hash64(_normalize_message_id(message_id)) if message_id else 0)
+            self.columns["header_hash"].append(_header_hash(headers))
+            added += 1
+        
+        self.folder_state[folder] = {
+            "uidvalidity": uidvalidity,
+            "last_uid": current_uids[-1] if current_uids else 0,
+            "messages": len(current_uids),
+            "highestmodseq": highestmodseq,
+            "updated": time.time()
+        }
+        return added
+    
+    def select_rows(self, folder: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None) -> Optional[List[int]]:
+        """Row numbers matching the filters, or None when every row matches"""
+        if folder is None and since is None and until is None:
+            return None
+        
+        folder_id = self.folders.index(folder) if folder in self.folders else -1
+        folder_column = self.columns["folder"]
+        date_column = self.columns["date"]
+        return [
+            row for row in range(len(self))
+            if (folder is None or folder_column[row] == folder_id)
+            and (since is None or date_column[row] >= since)
+            and (until is None or date_column[row] < until)
+        ]
+    
+    def column(self, name: str, rows: Optional[List[int]]) -> Any:
+        """Values of a column, restricted to the given rows"""
+        column = self.columns[name]
+        if rows is None:
+            return column
+        return [column[row] for row in rows]
+
+def _refresh_header_index(manager: EmailManager, folder: Optional[str] = None) -> HeaderIndex:
+    """Update the account's header index for one folder or for all folders"""
+    index = manager.get_header_index()
+    with index.lock:
+        with manager.imap(PRIORITY_BULK) as imap:
+            if folder:
+                index.refresh_folder(imap, folder)
+            else:
+                folders = manager.list_folders(imap, refresh=True)
+                for indexed_folder in list(index.folder_state):
+                    if indexed_folder not in folders:
+                        index.remove_folder(indexed_folder)
+                for mailbox_folder in folders:
+                    index.refresh_folder(imap, mailbox_folder)
+        index.save()
+    return index
+
+# strftime formats for the time buckets of the volume statistic
+_VOLUME_BUCKETS = {
+    "day": "%Y-%m-%d",
+    "week": "%G-W%V",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+@mcp.tool()
+def mailbox_stats(
+    stat: str = "summary",
+    folder: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    top: int = 10,
+    bucket: str = "day",
+    refresh: bool = True,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Compute mailbox statistics from the local header index.
+    
+    Args:
+        stat: Statistic to compute:
+            - 'summary': message count, total size, unread and flagged counts
+            - 'top_senders': senders with the most messages
+            - 'volume': message count per time bucket
+            - 'size_by_folder': message count and total size of every folder
+        folder: Restrict the statistic to one folder (optional)
+        since: Only count messages received on or after this date, YYYY-MM-DD (optional)
+        until: Only count messages received before this date, YYYY-MM-DD (optional)
+        top: Number of senders returned by 'top_senders'
+        bucket: Time bucket for 'volume': 'day', 'week', 'month' or 'year' (UTC)
+        refresh: Fetch new messages and flag changes from iCloud before computing
+        account: Account to analyze (optional, defaults to the default account)
+    
+    The index is built from header-only fetches and stored under ICLOUD_DATA_DIR. The
+    first refresh reads the headers of every message, later ones only new messages.
+    """
+    try:
+        if stat not in ("summary", "top_senders", "volume", "size_by_folder"):
+            return {"status": "error", "message": f"Unknown statistic '{stat}'"}
+        if bucket not in _VOLUME_BUCKETS:
+            return {"status": "error", "message": f"Unknown bucket '{bucket}', use day, week, month or year"}
+        
+        manager = _get_manager(account)
+        if refresh:
+            index = _refresh_header_index(manager, folder)
+        else:
+            index = manager.get_header_index()
+        
+        started = time.perf_counter()
+        with index.lock:
+            rows = index.select_rows(folder, _parse_date_filter(since), _parse_date_filter(until))
+            sizes = index.column("size", rows)
+            
+            if stat == "summary":
+                flags = index.column("flags", rows)
+                results = {
+                    "messages": len(sizes),
+                    "total_bytes": sum(sizes),
+                    "unread": sum(1 for value in flags if not value & _FLAG_BITS['\\Seen']),
+                    "flagged": sum(1 for value in flags if value & _FLAG_BITS['\\Flagged'])
+                }
+            
+            elif stat == "top_senders":
+                counts = Counter(index.column("sender", rows))
+                results = [
+                    {"sender": index.senders[sender_id], "count": count}
+                    for sender_id, count in counts.most_common(max(1, top))
+                ]
+            
+            elif stat == "volume":
+                # Count per UTC day first, then merge days into the requested bucket
+                days = Counter(date // 86400 for date in index.column("date", rows))
+                volume = Counter()
+                for day, count in days.items():
+                    volume[time.strftime(_VOLUME_BUCKETS[bucket], time.gmtime(day * 86400))] += count
+                results = [{"bucket": key, "count": volume[key]} for key in sorted(volume)]
+            
+            else:
+                totals = {}
+                for folder_id, size in zip(index.column("folder", rows), sizes):
+                    count, total = totals.get(folder_id, (0, 0))
+                    totals[folder_id] = (count + 1, total + size)
+                results = sorted(
+                    ({"folder": index.folders[folder_id], "messages": count, "total_bytes": total}
+                     for folder_id, (count, total) in totals.items()),
+                    key=lambda entry: entry["total_bytes"],
+                    reverse=True
+                )
+            
+            indexed_messages = len(index)
+        
+        return {
+            "status": "success",
+            "stat": stat,
+            "results": results,
+            "indexed_messages": indexed_messages,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to compute mailbox statistics: {str(e)}"}
+
+def _uid_move(imap, uids: List[int], destination_folder: str, chunk_size: int = 500):
+    """Move messages of the selected folder to another folder by UID, in batches.
+    
+    Uses UID MOVE when the server supports it, otherwise UID COPY followed by flagging
+    the originals as deleted and expunging them (with UID EXPUNGE when UIDPLUS allows,
+    so other messages already flagged as deleted are left alone).
+    """
+    quoted_destination = _quote_folder_name(destination_folder)
+    capabilities = imap.capabilities
+    for start in range(0, len(uids), chunk_size):
+        uid_set = _uid_set(uids[start:start + chunk_size])
+        if 'MOVE' in capabilities:
+            typ, data = imap.uid('MOVE', uid_set, quoted_destination)
+            if typ != 'OK':
+                raise Exception(f"Failed to move UIDs {uid_set} to {destination_folder}")
+            continue
+        
+        typ, data = imap.uid('COPY', uid_set, quoted_destination)
+        if typ != 'OK':
+            raise Exception(f"Failed to copy UIDs {uid_set} to {destination_folder}")
+        typ, data = imap.uid('STORE', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+        if typ != 'OK':
+            raise Exception(f"Failed to mark UIDs {uid_set} for deletion")
+        if 'UIDPLUS' in capabilities:
+            imap.uid('EXPUNGE', uid_set)
+        else:
+            imap.expunge()
+
+@mcp.tool()
+def find_duplicates(
+    folder: Optional[str] = None,
+    cleanup: bool = False,
+    trash_folder: str = "Deleted Messages",
+    prefer_folder: Optional[str] = None,
+    max_groups: int = 50,
+    refresh: bool = True,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Find messages stored more than once, optionally moving the extra copies to Trash.
+    
+    Args:
+        folder: Only look for duplicates within this folder (optional, default all folders)
+        cleanup: Move every copy except one per group to trash_folder
+        trash_folder: Folder receiving the extra copies; messages already there are ignored
+        prefer_folder: Keep the copy in this folder when a group spans several folders
+        max_groups: Maximum number of duplicate groups listed in the response
+        refresh: Update the header index from iCloud before searching
+        account: Account to deduplicate (optional, defaults to the default account)
+    
+    Messages are duplicates when Message-ID, size and a hash of their normalized
+    From/To/Cc/Subject/Date headers all match. Detection runs on the local header
+    index, so no message bodies are downloaded. Returned ids are IMAP UIDs.
+    """
+    try:
+        manager = _get_manager(account)
+        if refresh:
+            index = _refresh_header_index(manager, folder)
+        else:
+            index = manager.get_header_index()
+        
+        with index.lock:
+            rows = index.select_rows(folder)
+            if rows is None:
+                rows = range(len(index))
+            
+            trash_id = index.folders.index(trash_folder) if trash_folder in index.folders else -1
+            columns = index.columns
+            groups = {}
+            for row in rows:
+                if columns["folder"][row] == trash_id:
+                    continue
+                key = (columns["message_id"][row], columns["header_hash"][row], columns["size"][row])
+                groups.setdefault(key, []).append(row)
+            
+            duplicate_groups = []
+            for (message_id, header_hash, size), group_rows in groups.items():
+                if len(group_rows) < 2:
+                    continue
+                # Keep the copy in the preferred folder, otherwise the first one indexed
+                group_rows.sort(key=lambda row: index.folders[columns["folder"][row]] != prefer_folder)
+                copies = [{"folder": index.folders[columns["folder"][row]], "uid": columns["uid"][row]} for row in group_rows]
+                duplicate_groups.append({
+                    "sender": index.senders[columns["sender"][group_rows[0]]],
+                    "size": size,
+                    "keep": copies[0],
+                    "duplicates": copies[1:]
+                })
+        
+        duplicate_count = sum(len(group["duplicates"]) for group in duplicate_groups)
+        result = {
+            "status": "success",
+            "duplicate_groups": len(duplicate_groups),
+            "duplicate_messages": duplicate_count,
+            "reclaimable_bytes": sum(group["size"] * len(group["duplicates"]) for group in duplicate_groups),
+            "groups": duplicate_groups[:max(0, max_groups)]
+        }
+        
+        if cleanup and duplicate_count:
+            by_folder = {}
+            for group in duplicate_groups:
+                for copy in group["duplicates"]:
+                    by_folder.setdefault(copy["folder"], []).append(copy["uid"])
+            with index.lock:
+                indexed_uidvalidity = {
+                    source_folder: index.folder_state.get(source_folder, {}).get("uidvalidity")
+                    for source_folder in by_folder
+                }
+            
+            moved = {}
+            skipped = {}
+            with manager.imap(PRIORITY_BULK) as imap:
+                for source_folder, uids in by_folder.items():
+                    typ, select_result = imap.select(_quote_folder_name(source_folder))
+                    if typ != 'OK':
+                        skipped[source_folder] = "folder could not be selected"
+                        continue
+                    # Indexed UIDs only name the same messages while UIDVALIDITY is unchanged
+                    if _get_uidvalidity(imap) != indexed_uidvalidity[source_folder]:
+                        skipped[source_folder] = "folder UIDVALIDITY changed since it was indexed, refresh the index first"
+                        continue
+                    _uid_move(imap, sorted(uids), trash_folder)
+                    moved[source_folder] = uids
+            
+            with index.lock:
+                for source_folder, uids in moved.items():
+                    index.remove_uids(source_folder, uids)
+                index.save()
+            
+            moved_count = sum(len(uids) for uids in moved.values())
+            result["moved_count"] = moved_count
+            result["message"] = f"Moved {moved_count} duplicate emails to {trash_folder}"
+            if skipped:
+                result["skipped_folders"] = skipped
+        else:
+            result["message"] = f"Found {duplicate_count} duplicate emails in {len(duplicate_groups)} groups"
+        
+        return result
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to find duplicates: {str(e)}"}
+
+# Rule conditions matched with IMAP SEARCH text keys, and the headers they refer to
+_RULE_SEARCH_KEYS = {
+    "from": "FROM",
+    "to": "TO",
+    "cc": "CC",
+    "subject": "SUBJECT",
+    "body": "BODY",
+    "text": "TEXT",
+}
+_RULE_REGEX_HEADERS = {
+    "from_regex": "From",
+    "to_regex": "To",
+    "cc_regex": "Cc",
+    "subject_regex": "Subject",
+}
+
+# Header field names per RFC 5322: printable ASCII except the colon
+_HEADER_NAME_RE = re.compile(r'[!-9;-~]+')
+
+def _search_string(value: str) -> Optional[str]:
+    """Quote a value for IMAP SEARCH, or return None if it cannot be sent as a quoted ASCII string"""
+    value = str(value)
+    # imaplib sends arguments as they are, a line break would end the command early
+    if not value.isascii() or any(char in value for char in "\r\n\0"):
+        return None
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _search_date(value: str) -> str:
+    """Convert YYYY-MM-DD into the dd-Mon-yyyy form used by IMAP SEARCH"""
+    date = time.strptime(value, "%Y-%m-%d")
+    return f"{date.tm_mday}-{imaplib.Months[date.tm_mon]}-{date.tm_year}"
+
+def _decode_header_value(value: Optional[str]) -> str:
+    """Decode an RFC 2047 encoded header value into text"""
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+def _compile_rule_match(match: Dict[str, Any]) -> Any:
+    """Split rule conditions into an IMAP SEARCH query and locally evaluated checks.
+    
+    Returns the search criteria and a list of (header, predicate) pairs for conditions
+    the server cannot evaluate: regular expressions, non-ASCII text and text with line breaks.
+    """
+    criteria = []
+    local_checks = []
+    
+    for key, value in match.items():
+        if key in _RULE_SEARCH_KEYS:
+            quoted = _search_string(value)
+            if quoted is not None:
+                criteria += [_RULE_SEARCH_KEYS[key], quoted]
+            elif key in ("body", "text"):
+                raise Exception(f"Condition '{key}' only supports ASCII text without line breaks")
+            else:
+                needle = str(value).lower()
+                local_checks.append((key.title(), lambda text, needle=needle: needle in text.lower()))
+        elif key in _RULE_REGEX_HEADERS:
+            pattern = re.compile(value, re.IGNORECASE)
+            local_checks.append((_RULE_REGEX_HEADERS[key], lambda text, pattern=pattern: pattern.search(text) is not None))
+        elif key == "header":
+            for name, header_value in value.items():
+                # Header names also end up in local HEADER.FIELDS fetches and cannot be quoted there
+                if not _HEADER_NAME_RE.fullmatch(str(name)):
+                    raise Exception(f"Invalid header name {name!r}")
+                quoted = _search_string(header_value)
+                if quoted is not None:
+                    criteria += ['HEADER', _search_string(name), quoted]
+                else:
+                    needle = str(header_value).lower()
+                    local_checks.append((name, lambda text, needle=needle: needle in text.lower()))
+        elif key == "unread":
+            criteria.append('UNSEEN' if value else 'SEEN')
+        elif key == "flagged":
+            criteria.append('FLAGGED' if value else 'UNFLAGGED')
+        elif key == "since":
+            criteria += ['SINCE', _search_date(value)]
+        elif key == "before":
+            criteria += ['BEFORE', _search_date(value)]
+        elif key == "larger_than":
+            criteria += ['LARGER', str(int(value))]
+        elif key == "smaller_than":
+            criteria += ['SMALLER', str(int(value))]
+        else:
+            raise Exception(f"Unknown rule condition '{key}'")
+    
+    return " ".join(criteria) or "ALL", local_checks
+
+def _filter_uids_locally(imap, uids: List[int], local_checks: List[Any]) -> List[int]:
+    """Keep the UIDs whose headers satisfy every local check, using header-only fetches"""
+    headers = sorted({name.upper() for name, _ in local_checks})
+    matched = []
+    for meta, header in _uid_fetch(imap, uids, f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(headers)})])"):
+        uid = _parse_fetch_metadata(meta)["uid"]
+        if uid is None:
+            continue
+        # Raw UTF-8 headers (RFC 6532) are common, so decode before parsing
+        message = email.message_from_string((header or b'').decode('utf-8', errors='replace'))
+        if all(check(_decode_header_value(message.get(name))) for name, check in local_checks):
+            matched.append(uid)
+    return matched
+
+@mcp.tool()
+def apply_rules(
+    rules: List[Dict[str, Any]],
+    folder: str = "INBOX",
+    dry_run: bool = False,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Apply a list of triage rules to every message in a folder with bulk operations.
+    
+    Args:
+        rules: Rules evaluated in order, each with keys:
+            - 'name': Label used in the response (optional)
+            - 'match': Conditions that must all hold:
+                'from', 'to', 'cc', 'subject', 'body', 'text': substring match
+                'from_regex', 'to_regex', 'cc_regex', 'subject_regex': regular expression
+                'header': {"Header-Name": "substring"}
+                'unread', 'flagged': true or false
+                'since', 'before': YYYY-MM-DD
+                'larger_than', 'smaller_than': size in bytes
+            - 'actions': Any of {"move": "Folder", "flag": true/false, "mark_read": true/false}
+        folder: Folder to triage
+        dry_run: Only report what would be done
+        account: Account to triage (optional, defaults to the default account)
+    
+    Example rule:
+    {"name": "newsletters", "match": {"header": {"List-Id": "news"}, "unread": true},
+     "actions": {"mark_read": true, "move": "Newsletters"}}
+    
+    Conditions are evaluated by IMAP SEARCH on the server; regular expressions and
+    non-ASCII text are checked locally against fetched headers. A message moved by a
+    rule is not considered by later rules, and when rules set the same flag differently
+    the last matching rule wins. Actions of all rules are grouped into bulk UID STORE
+    and UID MOVE commands. Returned ids are IMAP UIDs.
+    """
+    try:
+        compiled = []
+        for position, rule in enumerate(rules):
+            actions = rule.get("actions", {})
+            unknown = set(actions) - {"move", "flag", "mark_read"}
+            if unknown:
+                return {"status": "error", "message": f"Unknown rule action '{sorted(unknown)[0]}'"}
+            criteria, local_checks = _compile_rule_match(rule.get("match", {}))
+            compiled.append((rule.get("name", f"rule {position + 1}"), criteria, local_checks, actions))
+        
+        manager = _get_manager(account)
+        with manager.imap(PRIORITY_BULK) as imap:
+            typ, select_result = imap.select(_quote_folder_name(folder), readonly=dry_run)
+            if typ != 'OK':
+                return {"status": "error", "message": f"Failed to select folder '{folder}'"}
+            
+            moved = set()
+            flag_states = {}
+            moves = {}
+            rule_results = []
+            
+            for name, criteria, local_checks, actions in compiled:
+                uids = [uid for uid in _search_uids(imap, criteria) if uid not in moved]
+                if local_checks and uids:
+                    uids = _filter_uids_locally(imap, uids, local_checks)
+                
+                for action, flag in (("flag", "\\Flagged"), ("mark_read", "\\Seen")):
+                    if action in actions:
+                        states = flag_states.setdefault(flag, {})
+                        for uid in uids:
+                            states[uid] = bool(actions[action])
+                if actions.get("move"):
+                    moves.setdefault(actions["move"], set()).update(uids)
+                    moved.update(uids)
+                
+                rule_results.append({
+                    "name": name,
+                    "matched": len(uids),
+                    "search": criteria,
+                    "local_conditions": len(local_checks),
+                    "uids": uids[:50]
+                })
+            
+            # Later rules override earlier ones, each message gets one final state per flag
+            flag_changes = {}
+            for flag, states in flag_states.items():
+                for uid, value in states.items():
+                    flag_changes.setdefault(('+FLAGS.SILENT' if value else '-FLAGS.SILENT', flag), set()).add(uid)
+            
+            if not dry_run:
+                # Flags first, moved messages get their new flags before they leave the folder
+                for (operation, flag), uids in flag_changes.items():
+                    uids = sorted(uids)
+                    for start in range(0, len(uids), 500):
+                        typ, store_result = imap.uid('STORE', _uid_set(uids[start:start + 500]), operation, f"({flag})")
+                        if typ != 'OK':
+                            raise Exception(f"Failed to update {flag} on {len(uids)} emails")
+                for destination_folder, uids in moves.items():
+                    if uids:
+                        _uid_move(imap, sorted(uids), destination_folder)
+        
+        changes = {
+            "flagged": len(flag_changes.get(('+FLAGS.SILENT', '\\Flagged'), ())),
+            "unflagged": len(flag_changes.get(('-FLAGS.SILENT', '\\Flagged'), ())),
+            "marked_read": len(flag_changes.get(('+FLAGS.SILENT', '\\Seen'), ())),
+            "marked_unread": len(flag_changes.get(('-FLAGS.SILENT', '\\Seen'), ())),
+            "moved": {destination_folder: len(uids) for destination_folder, uids in moves.items() if uids}
+        }
+        
+        verb = "Would apply" if dry_run else "Applied"
+        return {
+            "status": "success",
+            "message": f"{verb} {len(rules)} rules to {folder}",
+            "dry_run": dry_run,
+            "rules": rule_results,
+            "changes": changes
+        }
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to apply rules: {str(e)}"}
+
+def _parse_sequence_set(sequence_set: str, count: int) -> List[int]:
+    """Expand an IMAP sequence set such as '3', '1,4' or '2:*' for a folder of count messages"""
+    numbers = []
+    for part in str(sequence_set).replace(" ", "").split(","):
+        bounds = [count if bound == "*" else int(bound) for bound in part.split(":")]
+        start, end = min(bounds), max(bounds)
+        if start < 1 or end > count:
+            raise Exception(f"Email {part} not found in the offline copy of this folder")
+        numbers.extend(range(start, end + 1))
+    return sorted(set(numbers))
+
+class OfflineStore:
+    """Local copy of synced folders with a durable journal of changes made while offline.
+    
+    Every message of a synced folder has a row with its UID and flags, the most recent
+    ones also their raw content. Sequence numbers are the positions of the rows in UID
+    order, matching the numbering iCloud used at the last sync.
+    
+    Messages remember the folder and UID they had on the server ("origin"). Changes made
+    offline update the rows right away and are journaled against the origin, so a message
+    moved offline and then marked as read is replayed as one change of the original UID.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS folders (
+            name TEXT PRIMARY KEY,
+            uidvalidity INTEGER,
+            highestmodseq INTEGER,
+            max_messages INTEGER,
+            synced_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS folder_list (
+            name TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            folder TEXT NOT NULL,
+            uid INTEGER NOT NULL,
+            flags TEXT NOT NULL DEFAULT '',
+            internaldate REAL,
+            raw BLOB,
+            origin_folder TEXT NOT NULL,
+            origin_uid INTEGER NOT NULL,
+            origin_uidvalidity INTEGER,
+            PRIMARY KEY (folder, uid)
+        );
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created REAL NOT NULL,
+            action TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            uidvalidity INTEGER,
+            modseq INTEGER,
+            uids TEXT NOT NULL,
+            argument TEXT NOT NULL
+        );
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pending = None
+        self.last_replay = None
+    
+    def _db(self):
+        """Open the database on first use; callers must hold self.lock"""
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            # Journal entries must survive a crash once the tool has reported success
+            self.connection.execute("PRAGMA synchronous=FULL")
+            self.connection.executescript(self.SCHEMA)
+        return self.connection
+    
+    def _exists(self) -> bool:
+        return self.connection is not None or os.path.exists(self.path)
+    
+    def has_folder(self, folder: Optional[str] = None) -> bool:
+        """Check whether a folder (or, without a folder, anything at all) has been synced"""
+        if not self._exists():
+            return False
+        with self.lock:
+            if folder is None:
+                row = self._db().execute("SELECT 1 FROM folders LIMIT 1").fetchone()
+            else:
+                row = self._db().execute("SELECT 1 FROM folders WHERE name = ?", (folder,)).fetchone()
+        return row is not None
+    
+    def folder_names(self) -> List[str]:
+        """Folder names from the last sync, or the synced folders if no folder list was stored"""
+        with self.lock:
+            db = self._db()
+            names = [row[0] for row in db.execute("SELECT name FROM folder_list ORDER BY rowid")]
+            return names or [row[0] for row in db.execute("SELECT name FROM folders ORDER BY name")]
+    
+    def set_folder_list(self, names: List[str]):
+        with self.lock, self._db() as db:
+            db.execute("DELETE FROM folder_list")
+            db.executemany("INSERT OR IGNORE INTO folder_list (name) VALUES (?)", [(name,) for name in names])
+    
+    def folder_state(self, folder: str) -> Optional[Dict[str, Any]]:
+        """Sync state of a folder, or None if it has never been synced"""
+        with self.lock:
+            row = self._db().execute(
+                "SELECT uidvalidity, highestmodseq, max_messages, synced_at FROM folders WHERE name = ?", (folder,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"uidvalidity": row[0], "highestmodseq": row[1], "max_messages": row[2], "synced_at": row[3]}
+    
+    def synced_folders(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self._db().execute("SELECT name FROM folders ORDER BY name")]
+    
+    def prepare_sync(self, folder: str, uidvalidity: Optional[int]) -> Dict[int, bool]:
+        """Start syncing a folder and return which local UIDs already have their content.
+        
+        Rows of messages moved here offline are dropped, the server's copies replace them.
+        If UIDVALIDITY changed the UIDs refer to different messages and the folder starts over.
+        """
+        with self.lock, self._db() as db:
+            row = db.execute("SELECT uidvalidity FROM folders WHERE name = ?", (folder,)).fetchone()
+            if row is not None and row[0] != uidvalidity:
+                db.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+                db.execute("DELETE FROM folders WHERE name = ?", (folder,))
+            db.execute(
+                "DELETE FROM messages WHERE folder = ? AND (origin_folder != folder OR origin_uid != uid)", (folder,)
+            )
+            return {
+                uid: has_body
+                for uid, has_body in db.execute("SELECT uid, raw IS NOT NULL FROM messages WHERE folder = ?", (folder,))
+            }
+    
+    def apply_sync(
+        self,
+        folder: str,
+        uidvalidity: Optional[int],
+        highestmodseq: Optional[int],
+        max_messages: int,
+        server_uids: List[int],
+        flags: Dict[int, List[str]],
+        keep_bodies: set
+    ) -> int:
+        """Bring the rows of a folder in line with the server, returning the number of rows removed"""
+        with self.lock, self._db() as db:
+            local_uids = {row[0] for row in db.execute("SELECT uid FROM messages WHERE folder = ?", (folder,))}
+            removed = local_uids - set(server_uids)
+            db.executemany("DELETE FROM messages WHERE folder = ? AND uid = ?", [(folder, uid) for uid in removed])
+            db.executemany(
+                """INSERT INTO messages (folder, uid, flags, origin_folder, origin_uid, origin_uidvalidity)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (folder, uid) DO UPDATE SET flags = excluded.flags""",
+                [(folder, uid, " ".join(uid_flags), folder, uid, uidvalidity) for uid, uid_flags in flags.items()]
+            )
+            # Only the most recent messages keep their content
+            db.executemany(
+                "UPDATE messages SET raw = NULL WHERE folder = ? AND uid = ? AND raw IS NOT NULL",
+                [(folder, uid) for uid in local_uids - removed - keep_bodies]
+            )
+            db.execute(
+                """INSERT OR REPLACE INTO folders (name, uidvalidity, highestmodseq, max_messages, synced_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (folder, uidvalidity, highestmodseq, max_messages, time.time())
+            )
+        return len(removed)
+    
+    def save_bodies(self, folder: str, messages: List[Dict[str, Any]]):
+        """Store fetched message content together with its current flags"""
+        with self.lock, self._db() as db:
+            db.executemany(
+                "UPDATE messages SET raw = ?, flags = ?, internaldate = ? WHERE folder = ? AND uid = ?",
+                [(message["raw"], " ".join(message["flags"]), message["internaldate"], folder, message["uid"])
+                 for message in messages]
+            )
+    
+    def recent_messages(self, folder: str, limit: int, unread_only: bool = False) -> List[Any]:
+        """Return (sequence number, flags, raw) of the newest messages, newest first"""
+        condition = "WHERE instr(flags, '\\Seen') = 0" if unread_only else ""
+        with self.lock:
+            return [
+                (seq, flags.split(), raw)
+                for seq, flags, raw in self._db().execute(
+                    f"""WITH numbered AS (
+                            SELECT ROW_NUMBER() OVER (ORDER BY uid) AS seq, uid, flags
+                            FROM messages WHERE folder = ?
+                        )
+                        SELECT numbered.seq, numbered.flags, messages.raw
+                        FROM (SELECT * FROM numbered {condition} ORDER BY seq DESC LIMIT ?) AS numbered
+                        JOIN messages ON messages.folder = ? AND messages.uid = numbered.uid
+                        ORDER BY numbered.seq DESC""",
+                    (folder, max(0, limit), folder)
+                )
+            ]
+    
+    def _resolve(self, db, folder: str, sequence_set: str) -> List[Any]:
+        """Rows addressed by a sequence set: (seq, uid, flags, raw, origin folder, origin UID, origin UIDVALIDITY)"""
+        count = db.execute("SELECT COUNT(*) FROM messages WHERE folder = ?", (folder,)).fetchone()[0]
+        wanted = set(_parse_sequence_set(sequence_set, count))
+        rows = db.execute(
+            """SELECT ROW_NUMBER() OVER (ORDER BY uid) AS seq, uid FROM messages WHERE folder = ?""", (folder,)
+        ).fetchall()
+        return [
+            (seq,) + db.execute(
+                """SELECT uid, flags, raw, origin_folder, origin_uid, origin_uidvalidity
+                   FROM messages WHERE folder = ? AND uid = ?""", (folder, uid)
+            ).fetchone()
+            for seq, uid in rows if seq in wanted
+        ]
+    
+    def messages(self, folder: str, sequence_set: str) -> List[Any]:
+        """Return (sequence number, flags, raw) of the messages addressed by a sequence set"""
+        with self.lock:
+            return [(row[0], row[2].split(), row[3]) for row in self._resolve(self._db(), folder, sequence_set)]
+    
+    def _journal(self, db, action: str, rows: List[Any], argument: Dict[str, Any]):
+        """Append one journal entry per origin folder of the changed rows"""
+        by_origin = {}
+        for row in rows:
+            by_origin.setdefault((row[4], row[6]), []).append(row[5])
+        for (origin_folder, origin_uidvalidity), uids in by_origin.items():
+            state = db.execute("SELECT highestmodseq FROM folders WHERE name = ?", (origin_folder,)).fetchone()
+            db.execute(
+                """INSERT INTO journal (created, action, folder, uidvalidity, modseq, uids, argument)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (time.time(), action, origin_folder, origin_uidvalidity, state[0] if state else None,
+                 json.dumps(sorted(uids)), json.dumps(argument))
+            )
+        self.pending = None
+    
+    def set_flags(self, folder: str, sequence_set: str, add: List[str] = (), remove: List[str] = ()) -> int:
+        """Change flags locally and journal the change, returning the number of messages changed"""
+        with self.lock, self._db() as db:
+            rows = self._resolve(db, folder, sequence_set)
+            for row in rows:
+                flags = (set(row[2].split()) | set(add)) - set(remove)
+                db.execute(
+                    "UPDATE messages SET flags = ? WHERE folder = ? AND uid = ?", (" ".join(sorted(flags)), folder, row[1])
+                )
+            self._journal(db, "flags", rows, {"add": list(add), "remove": list(remove)})
+        return len(rows)
+    
+    def move(self, folder: str, sequence_set: str, destination_folder: str) -> int:
+        """Move messages locally and journal the move, returning the number of messages moved.
+        
+        In a synced destination the messages get temporary UIDs after the highest known one,
+        so they are listed last like newly arrived mail until the next sync.
+        """
+        with self.lock, self._db() as db:
+            rows = self._resolve(db, folder, sequence_set)
+            self._journal(db, "move", rows, {"destination": destination_folder})
+            synced = db.execute("SELECT 1 FROM folders WHERE name = ?", (destination_folder,)).fetchone()
+            next_uid = db.execute(
+                "SELECT COALESCE(MAX(uid), 0) + 1 FROM messages WHERE folder = ?", (destination_folder,)
+            ).fetchone()[0]
+            for offset, row in enumerate(rows):
+                if synced:
+                    db.execute(
+                        "UPDATE messages SET folder = ?, uid = ? WHERE folder = ? AND uid = ?",
+                        (destination_folder, next_uid + offset, folder, row[1])
+                    )
+                else:
+                    db.execute("DELETE FROM messages WHERE folder = ? AND uid = ?", (folder, row[1]))
+        return len(rows)
+    
+    def pending_changes(self) -> int:
+        """Number of journal entries waiting to be replayed"""
+        if self.pending is None:
+            if not self._exists():
+                return 0
+            with self.lock:
+                self.pending = self._db().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        return self.pending
+    
+    def journal_entries(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                {
+                    "id": entry_id,
+                    "action": action,
+                    "folder": folder,
+                    "uidvalidity": uidvalidity,
+                    "modseq": modseq,
+                    "uids": json.loads(uids),
+                    "argument": json.loads(argument)
+                }
+                for entry_id, action, folder, uidvalidity, modseq, uids, argument in self._db().execute(
+                    "SELECT id, action, folder, uidvalidity, modseq, uids, argument FROM journal ORDER BY id"
+                )
+            ]
+    
+    def remove_journal_entries(self, entry_ids: List[int]):
+        with self.lock, self._db() as db:
+            db.executemany("DELETE FROM journal WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+            self.pending = None
+    
+    def status(self) -> Dict[str, Any]:
+        """Synced folders with their message counts, and the number of queued changes"""
+        folders = {}
+        if self._exists():
+            with self.lock:
+                for name, total, with_body, synced_at in self._db().execute(
+                    """SELECT folders.name, COUNT(messages.uid), COUNT(messages.raw), folders.synced_at
+                       FROM folders LEFT JOIN messages ON messages.folder = folders.name
+                       GROUP BY folders.name ORDER BY folders.name"""
+                ):
+                    folders[name] = {
+                        "messages": total,
+                        "available_offline": with_body,
+                        "synced_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(synced_at))
+                    }
+        return {"folders": folders, "pending_changes": self.pending_changes()}
+
+def _offline_store(manager: EmailManager, folder: Optional[str] = None) -> Optional[OfflineStore]:
+    """Return the account's offline store if it can serve the folder, otherwise None"""
+    if OFFLINE_MODE == "off":
+        return None
+    store = manager.get_offline_store()
+    return store if store.has_folder(folder) else None
+
+def _queue_offline(manager: EmailManager, folder: str, error: Exception, message: str, change) -> Dict[str, Any]:
+    """Apply a change to the offline store and queue it for replay, or report the connection error"""
+    store = _offline_store(manager, folder)
+    if store is None:
+        return {"status": "error", "message": str(error)}
+    try:
+        change(store)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success", "message": f"{message} (offline, queued until iCloud is reachable)", "offline": True}
+
+def _offline_summary(seq: int, flags: List[str], raw: Optional[bytes], full_content: bool) -> Optional[Dict[str, Any]]:
+    """Format a stored message for email listings"""
+    if raw is None:
+        return {"error": f"Email {seq} is not available offline, only the newest messages of a folder are synced"}
+    summary = _email_summary(str(seq), raw, '\\Seen' not in flags, full_content)
+    if summary:
+        summary["offline"] = True
+    return summary
+
+def _read_emails_offline(store: OfflineStore, folder: str, limit: int, full_content: bool) -> List[Dict[str, Any]]:
+    """Read the most recent emails of a folder from the offline store"""
+    summaries = (_offline_summary(seq, flags, raw, full_content) for seq, flags, raw in store.recent_messages(folder, limit))
+    return [summary for summary in summaries if summary]
+
+def _get_unread_emails_offline(store: OfflineStore, folder: str, limit: int) -> List[Dict[str, Any]]:
+    """Read only unread emails of a folder from the offline store"""
+    summaries = (_offline_summary(seq, flags, raw, False) for seq, flags, raw in store.recent_messages(folder, limit, unread_only=True))
+    return [summary for summary in summaries if summary]
+
+def _read_full_email_offline(store: OfflineStore, email_id: str, folder: str) -> Dict[str, Any]:
+    """Read the complete content of one email from the offline store"""
+    try:
+        messages = store.messages(folder, email_id)
+    except Exception as e:
+        return {"error": f"Failed to read email {email_id}: {str(e)}"}
+    if not messages:
+        return {"error": f"Email {email_id} not found or could not be retrieved"}
+    
+    seq, flags, raw = messages[0]
+    if raw is None:
+        return {"error": f"Email {email_id} is not available offline, only the newest messages of a folder are synced"}
+    result = _email_details(email_id, raw, '\\Seen' not in flags, folder)
+    result["offline"] = True
+    return result
+
+_HIGHESTMODSEQ_RE = re.compile(rb'HIGHESTMODSEQ (\d+)')
+_MODIFIED_RE = re.compile(rb'\[MODIFIED ([\d:,]+)\]')
+
+def _get_highestmodseq(imap, quoted_folder: str) -> Optional[int]:
+    """Return a folder's HIGHESTMODSEQ, or None if the server does not support CONDSTORE"""
+    if 'CONDSTORE' not in imap.capabilities:
+        return None
+    typ, data = imap.status(quoted_folder, '(HIGHESTMODSEQ)')
+    match = _HIGHESTMODSEQ_RE.search(data[0]) if typ == 'OK' and data and data[0] else None
+    return int(match.group(1)) if match else None
+
+def _sync_offline_folder(imap, store: OfflineStore, folder: str, max_messages: int) -> Dict[str, int]:
+    """Update the offline copy of one folder: UIDs and flags of all messages, content of the newest"""
+    quoted_folder = _quote_folder_name(folder)
+    # Read the mod-sequence before the flags so changes made meanwhile count as conflicts later
+    highestmodseq = _get_highestmodseq(imap, quoted_folder)
+    typ, select_result = imap.select(quoted_folder, readonly=True)
+    if typ != 'OK':
+        raise Exception(f"Failed to select folder '{folder}'")
+    
+    uidvalidity = _get_uidvalidity(imap)
+    previous = store.folder_state(folder)
+    local = store.prepare_sync(folder, uidvalidity)
+    server_uids = _search_uids(imap, 'ALL')
+    
+    # With CONDSTORE only the flags changed since the last sync need to be fetched
+    items = '(UID FLAGS)'
+    if highestmodseq is not None and previous and previous["uidvalidity"] == uidvalidity and previous["highestmodseq"]:
+        items = f'(UID FLAGS) (CHANGEDSINCE {previous["highestmodseq"]})'
+    flags = {}
+    for meta, _ in _uid_fetch(imap, server_uids, items):
+        info = _parse_fetch_metadata(meta)
+        if info["uid"] is not None:
+            flags[info["uid"]] = info["flags"]
+    unknown = [uid for uid in server_uids if uid not in local and uid not in flags]
+    for meta, _ in _uid_fetch(imap, unknown, '(UID FLAGS)'):
+        info = _parse_fetch_metadata(meta)
+        if info["uid"] is not None:
+            flags[info["uid"]] = info["flags"]
+    
+    keep_bodies = set(server_uids[-max_messages:]) if max_messages > 0 else set()
+    removed = store.apply_sync(folder, uidvalidity, highestmodseq, max_messages, server_uids, flags, keep_bodies)
+    
+    missing = sorted(uid for uid in keep_bodies if not local.get(uid))
+    sizes = _fetch_sizes(imap, missing)
+    for batch in _pack_batches(missing, sizes, BATCH_SIZE):
+        typ, msg_data = imap.uid('FETCH', _uid_set(batch), '(UID FLAGS INTERNALDATE BODY.PEEK[])')
+        if typ != 'OK':
+            raise Exception(f"Failed to fetch UIDs {batch[0]}:{batch[-1]}")
+        messages = []
+        for meta, raw in _iter_fetch_response(msg_data):
+            info = _parse_fetch_metadata(meta)
+            if raw is not None and info["uid"] is not None:
+                messages.append(dict(info, raw=raw))
+        store.save_bodies(folder, messages)
+    
+    return {
+        "messages": len(server_uids),
+        "flags_updated": len(flags),
+        "downloaded": len(missing),
+        "removed": removed
+    }
+
+def _sync_offline(manager: EmailManager, folders: List[str], max_messages: Optional[int] = None) -> Dict[str, Any]:
+    """Sync several folders of an account into its offline store in one bulk session"""
+    store = manager.get_offline_store()
+    results = {}
+    with manager.imap(PRIORITY_BULK) as imap:
+        store.set_folder_list(manager.list_folders(imap, refresh=True))
+        for folder in folders:
+            state = store.folder_state(folder)
+            folder_max = max_messages
+            if folder_max is None:
+                folder_max = state["max_messages"] if state and state["max_messages"] is not None else OFFLINE_MAX_MESSAGES
+            try:
+                results[folder] = _sync_offline_folder(imap, store, folder, folder_max)
+            except _OFFLINE_ERRORS:
+                raise
+            except Exception as e:
+                results[folder] = {"error": str(e)}
+    return results
+
+def _parse_uid_set(uid_set: str) -> List[int]:
+    """Expand a UID set such as '1:3,7' into its UIDs"""
+    uids = []
+    for part in uid_set.split(","):
+        bounds = [int(bound) for bound in part.split(":")]
+        uids.extend(range(min(bounds), max(bounds) + 1))
+    return uids
+
+def _uid_store_flag(imap, uids: List[int], flag: str, add: bool, unchanged_since: Optional[int], chunk_size: int = 500) -> List[int]:
+    """Add or remove a flag by UID in batches, returning the UIDs rejected as modified.
+    
+    With CONDSTORE the change is conditional on UNCHANGEDSINCE, so messages changed on
+    the server after the last sync are left alone. imaplib drops the tagged response text
+    of UID commands, so the command is sent with _simple_command to read MODIFIED.
+    """
+    modified = []
+    for start in range(0, len(uids), chunk_size):
+        uid_set = _uid_set(uids[start:start + chunk_size])
+        arguments = [uid_set]
+        if unchanged_since is not None and 'CONDSTORE' in imap.capabilities:
+            arguments.append(f'(UNCHANGEDSINCE {unchanged_since})')
+        arguments += ['+FLAGS.SILENT' if add else '-FLAGS.SILENT', f'({flag})']
+        typ, data = imap._simple_command('UID', 'STORE', *arguments)
+        # Mod-sequence updates come back as untagged FETCH responses even with .SILENT
+        imap.untagged_responses.pop('FETCH', None)
+        if typ != 'OK':
+            raise Exception(f"Failed to store {flag} on UIDs {uid_set}")
+        match = _MODIFIED_RE.search(data[0]) if data and data[0] else None
+        if match:
+            modified.extend(_parse_uid_set(match.group(1).decode()))
+    return modified
+
+def _fold_journal(entries: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+    """Reduce journal entries to the net change of every message, keyed by (folder, UIDVALIDITY).
+    
+    Each message maps to the flags it should end up with and its final folder, so marking
+    a message read and unread again, or moving it back, costs no command at all.
+    """
+    folded = {}
+    for entry in entries:
+        changes = folded.setdefault((entry["folder"], entry["uidvalidity"]), {"entry_ids": [], "modseq": None, "messages": {}})
+        changes["entry_ids"].append(entry["id"])
+        if entry["modseq"] is not None:
+            changes["modseq"] = min(entry["modseq"], changes["modseq"] or entry["modseq"])
+        
+        for uid in entry["uids"]:
+            message = changes["messages"].setdefault(uid, {"flags": {}, "destination": None})
+            if entry["action"] == "flags":
+                for flag in entry["argument"].get("add", []):
+                    message["flags"][flag] = True
+                for flag in entry["argument"].get("remove", []):
+                    message["flags"][flag] = False
+            elif entry["action"] == "move":
+                destination_folder = entry["argument"]["destination"]
+                message["destination"] = None if destination_folder == entry["folder"] else destination_folder
+    return folded
+
+def _folder_exists(imap, folder: str) -> bool:
+    """Check with a fresh LIST whether a folder exists, assuming it does if LIST fails"""
+    typ, data = imap.list('""', _quote_folder_name(folder))
+    if typ != 'OK':
+        return True
+    return any(item for item in data or [])
+
+def _replay_folder(imap, folder: str, uidvalidity: Optional[int], changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Apply the folded offline changes of one folder with batched UID commands, returning conflicts"""
+    messages = changes["messages"]
+    uids = sorted(messages)
+    
+    def conflict(conflicting_uids: List[int], reason: str) -> List[Dict[str, Any]]:
+        return [{"folder": folder, "uids": sorted(conflicting_uids), "reason": reason}] if conflicting_uids else []
+    
+    typ, select_result = imap.select(_quote_folder_name(folder))
+    if typ != 'OK':
+        # Only a folder that is really gone is a conflict. Anything else, e.g. throttling that
+        # outlasted the retries, keeps the journal entries queued for the next replay.
+        if _is_throttle_response(select_result) or _folder_exists(imap, folder):
+            raise Exception(f"Failed to select folder '{folder}'")
+        return conflict(uids, "folder no longer exists")
+    if uidvalidity is not None and _get_uidvalidity(imap) != uidvalidity:
+        return conflict(uids, "folder UIDVALIDITY changed, the UIDs refer to other messages now")
+    
+    current = {}
+    for meta, _ in _uid_fetch(imap, uids, '(UID FLAGS)'):
+        info = _parse_fetch_metadata(meta)
+        if info["uid"] is not None:
+            current[info["uid"]] = set(info["flags"])
+    conflicts = conflict([uid for uid in uids if uid not in current], "message was moved or deleted on the server")
+    
+    # One UID STORE per flag change, skipping messages that already look as wanted
+    stores = {}
+    for uid, flags in current.items():
+        for flag, wanted in messages[uid]["flags"].items():
+            if (flag in flags) != wanted:
+                stores.setdefault((flag, wanted), []).append(uid)
+    for (flag, wanted), store_uids in sorted(stores.items()):
+        modified = _uid_store_flag(imap, store_uids, flag, wanted, changes["modseq"])
+        conflicts += conflict(modified, f"{flag} was changed on the server since the last sync")
+    
+    moves = {}
+    for uid in current:
+        if messages[uid]["destination"]:
+            moves.setdefault(messages[uid]["destination"], []).append(uid)
+    for destination_folder, move_uids in moves.items():
+        try:
+            _uid_move(imap, sorted(move_uids), destination_folder)
+        except _OFFLINE_ERRORS:
+            raise
+        except Exception as e:
+            # E.g. the destination folder was deleted, retrying would fail the same way
+            conflicts += conflict(move_uids, f"move to {destination_folder} failed: {str(e)}")
+    return conflicts
+
+def _replay_offline_changes(manager: EmailManager) -> Dict[str, Any]:
+    """Send the changes queued while offline to iCloud, then resync the synced folders they touched.
+    
+    Journal entries of a folder are removed once its changes were sent, so an interrupted
+    replay resumes with the folders that are left. Conflicting changes are dropped in favor
+    of the server's state and reported.
+    """
+    store = manager.get_offline_store()
+    with manager.replay_lock:
+        entries = store.journal_entries()
+        replayed = 0
+        conflicts = []
+        touched = set()
+        if entries:
+            with manager.imap(PRIORITY_BULK) as imap:
+                for (folder, uidvalidity), changes in _fold_journal(entries).items():
+                    conflicts += _replay_folder(imap, folder, uidvalidity, changes)
+                    store.remove_journal_entries(changes["entry_ids"])
+                    replayed += len(changes["entry_ids"])
+                    touched.add(folder)
+                    touched.update(message["destination"] for message in changes["messages"].values() if message["destination"])
+            
+            # Moved messages have new UIDs and conflicts left optimistic local state behind
+            synced = [folder for folder in sorted(touched) if store.has_folder(folder)]
+            if synced:
+                _sync_offline(manager, synced)
+        
+        result = {"replayed_changes": replayed, "conflicts": conflicts}
+        if entries:
+            store.last_replay = dict(result, finished=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        return result
+
+def _start_offline_replay(manager: EmailManager):
+    """Replay queued offline changes in the background once iCloud is reachable again"""
+    if OFFLINE_MODE == "off" or not manager.get_offline_store().pending_changes():
+        return
+    if manager.replay_lock.locked():
+        return
+    
+    def replay():
+        try:
+            result = _replay_offline_changes(manager)
+            if result["conflicts"]:
+                print(f"Offline changes of account '{manager.name}' conflicted: {result['conflicts']}", file=sys.stderr)
+        except Exception as e:
+            print(f"Replaying offline changes of account '{manager.name}' failed: {e}", file=sys.stderr)
+    
+    threading.Thread(target=replay, name=f"offline-replay-{manager.name}", daemon=True).start()
+
+@mcp.tool()
+def sync_offline(
+    folders: Optional[List[str]] = None,
+    max_messages: Optional[int] = None,
+    account: Optional[str] = None
+) -> Dict[str, Any]:
+    """Sync folders into the local offline store so they can be read while iCloud is unreachable.
+    
+    Args:
+        folders: Folders to sync (optional, defaults to the folders synced before, or INBOX)
+        max_messages: Number of newest messages per folder whose content is kept locally
+            (optional, defaults to the previous setting of the folder or ICLOUD_OFFLINE_MAX_MESSAGES)
+        account: Account to sync (optional, defaults to the default account)
+    
+    Changes queued while offline are sent to iCloud first. UIDs and flags of all messages
+    are synced so offline email IDs match iCloud's; later syncs only download new messages.
+    """
+    try:
+        if OFFLINE_MODE == "off":
+            return {"status": "error", "message": "Offline mode is disabled (ICLOUD_OFFLINE=off)"}
+        
+        manager = _get_manager(account)
+        store = manager.get_offline_store()
+        replay = _replay_offline_changes(manager)
+        folders = folders or store.synced_folders() or ["INBOX"]
+        results = _sync_offline(manager, folders, max_messages)
+        
+        return {
+            "status": "success",
+            "message": f"Synced {len(folders)} folders for offline use",
+            "folders": results,
+            "replayed_changes": replay["replayed_changes"],
+            "conflicts": replay["conflicts"]
+        }
+        
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to sync offline store: {str(e)}"}
+
+@mcp.tool()
+def offline_status(account: Optional[str] = None) -> Dict[str, Any]:
+    """Show the folders available offline, the changes queued for iCloud and the last replay"""
+    try:
+        manager = _get_manager(account)
+        store = manager.get_offline_store()
+        status = store.status()
+        status["mode"] = OFFLINE_MODE
+        status["last_replay"] = store.last_replay
+        return status
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+_MODULE_READY.set()
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    _mark_startup("tools_registered")
+    try:
+        mcp.run()
+    finally:
+        for manager in email_managers.values():
+            manager.disconnect()
\ No newline at end of file
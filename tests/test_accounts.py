@@ -0,0 +1,41 @@
+import pytest
+
+import server
+
+
+def test_single_account_from_plain_variables(monkeypatch):
+    monkeypatch.delenv("ICLOUD_ACCOUNTS", raising=False)
+    monkeypatch.delenv("ICLOUD_DEFAULT_ACCOUNT", raising=False)
+    monkeypatch.setenv("ICLOUD_USERNAME", "me@icloud.com")
+    monkeypatch.setenv("ICLOUD_APP_PASSWORD", "secret")
+    accounts, default_account = server._load_accounts()
+    assert accounts == {"default": {"username": "me@icloud.com", "app_password": "secret"}}
+    assert default_account == "default"
+
+
+def test_named_accounts_and_default(monkeypatch):
+    monkeypatch.setenv("ICLOUD_ACCOUNTS", "personal, work-mail")
+    monkeypatch.setenv("ICLOUD_USERNAME_PERSONAL", "me@icloud.com")
+    monkeypatch.setenv("ICLOUD_APP_PASSWORD_PERSONAL", "secret-1")
+    monkeypatch.setenv("ICLOUD_USERNAME_WORK_MAIL", "team@icloud.com")
+    monkeypatch.setenv("ICLOUD_APP_PASSWORD_WORK_MAIL", "secret-2")
+    monkeypatch.setenv("ICLOUD_DEFAULT_ACCOUNT", "work-mail")
+    accounts, default_account = server._load_accounts()
+    assert list(accounts) == ["personal", "work-mail"]
+    assert accounts["work-mail"]["username"] == "team@icloud.com"
+    assert default_account == "work-mail"
+
+
+def test_account_without_credentials_is_rejected(monkeypatch):
+    monkeypatch.setenv("ICLOUD_ACCOUNTS", "personal")
+    monkeypatch.setenv("ICLOUD_USERNAME_PERSONAL", "me@icloud.com")
+    monkeypatch.delenv("ICLOUD_APP_PASSWORD_PERSONAL", raising=False)
+    with pytest.raises(SystemExit, match="ICLOUD_APP_PASSWORD_PERSONAL"):
+        server._load_accounts()
+
+
+def test_unknown_default_account_is_rejected(monkeypatch):
+    monkeypatch.delenv("ICLOUD_ACCOUNTS", raising=False)
+    monkeypatch.setenv("ICLOUD_DEFAULT_ACCOUNT", "bogus")
+    with pytest.raises(SystemExit, match="'bogus' is not a configured account"):
+        server._load_accounts()
@@ -0,0 +1,165 @@
+import json
+import mailbox
+from contextlib import contextmanager
+
+import server
+
+
+def message(uid):
+    return f"From: a@x.com\r\nSubject: message {uid}\r\nMessage-ID: <m{uid}@x>\r\n\r\nbody {uid}\r\n".encode()
+
+
+class ExportIMAP:
+    """Read-only folder serving SEARCH and FETCH by UID"""
+    
+    def __init__(self, uids, uidvalidity=1):
+        self.messages = {uid: message(uid) for uid in uids}
+        self.uidvalidity = uidvalidity
+    
+    def select(self, folder, readonly=False):
+        return 'OK', [str(len(self.messages)).encode()]
+    
+    def response(self, code):
+        return code, [str(self.uidvalidity).encode()]
+    
+    def uid(self, command, *args):
+        uids = sorted(self.messages)
+        if command == 'SEARCH':
+            first = int(args[0].split()[1].split(":")[0])
+            # "n:*" always matches the highest UID
+            matched = [uid for uid in uids if uid >= first] or uids[-1:]
+            return 'OK', [" ".join(str(uid) for uid in matched).encode()]
+    
+        response = []
+        for uid in server._parse_uid_set(args[0]):
+            raw = self.messages.get(uid)
+            if raw is None:
+                continue
+            if 'RFC822.SIZE' in args[1]:
+                response.append(f'{uid} (UID {uid} RFC822.SIZE {len(raw)})'.encode())
+            else:
+                meta = f'{uid} (UID {uid} FLAGS (\\Seen) INTERNALDATE "01-Jan-2024 10:00:00 +0000" BODY[] {{{len(raw)}}}'
+                response += [(meta.encode(), raw), b')']
+        return 'OK', response
+
+
+class ExportManager:
+    name = "default"
+    
+    def __init__(self, imap):
+        self.connection = imap
+    
+    @contextmanager
+    def imap(self, priority=server.PRIORITY_INTERACTIVE):
+        yield self.connection
+
+
+def export(monkeypatch, imap, destination, **kwargs):
+    monkeypatch.setattr(server, "_get_manager", lambda account: ExportManager(imap))
+    return server.export_folder.fn("INBOX", str(destination), **kwargs)
+
+
+def subjects(destination):
+    box = mailbox.mbox(str(destination))
+    try:
+        return sorted(int(box[key]["Subject"].split()[1]) for key in box.keys())
+    finally:
+        box.close()
+
+
+def test_incremental_export_resumes_from_the_checkpoint(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    imap = ExportIMAP([1, 2, 3])
+    assert export(monkeypatch, imap, destination)["exported_count"] == 3
+    
+    imap.messages[4] = message(4)
+    result = export(monkeypatch, imap, destination)
+    assert result["exported_count"] == 1
+    assert result["last_uid"] == 4
+    assert subjects(destination) == [1, 2, 3, 4]
+    
+    assert export(monkeypatch, imap, destination)["exported_count"] == 0
+    assert subjects(destination) == [1, 2, 3, 4]
+
+
+def test_full_export_replaces_the_previous_one(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    imap = ExportIMAP([1, 2, 3, 4])
+    export(monkeypatch, imap, destination)
+    assert export(monkeypatch, imap, destination, incremental=False)["exported_count"] == 4
+    assert subjects(destination) == [1, 2, 3, 4]
+
+
+def test_full_maildir_export_replaces_the_previous_one(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox"
+    imap = ExportIMAP([1, 2, 3, 4])
+    export(monkeypatch, imap, destination, mailbox_format="maildir")
+    export(monkeypatch, imap, destination, mailbox_format="maildir", incremental=False)
+    assert len(mailbox.Maildir(str(destination))) == 4
+
+
+def test_uidvalidity_change_starts_over(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    export(monkeypatch, ExportIMAP([1, 2, 3]), destination)
+    
+    result = export(monkeypatch, ExportIMAP([1, 2], uidvalidity=2), destination)
+    assert result["exported_count"] == 2
+    assert "UIDVALIDITY" in result["warning"]
+    assert subjects(destination) == [1, 2]
+    assert json.loads((tmp_path / "inbox.mbox.checkpoint.json").read_text())["uidvalidity"] == 2
+
+
+def test_checkpoint_only_advances_after_flush(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    checkpoint_path = str(tmp_path / "inbox.mbox.checkpoint.json")
+    flush = mailbox.mbox.flush
+    checkpoint_at_flush = []
+    
+    def recording_flush(box):
+        checkpoint_at_flush.append(server._load_json(checkpoint_path).get("last_uid", 0))
+        flush(box)
+    
+    monkeypatch.setattr(mailbox.mbox, "flush", recording_flush)
+    export(monkeypatch, ExportIMAP([1, 2, 3, 4]), destination, batch_size=2)
+    assert checkpoint_at_flush[:2] == [0, 2]
+    assert server._load_json(checkpoint_path)["last_uid"] == 4
+
+
+def test_interrupted_export_resumes_after_the_last_written_batch(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    imap = ExportIMAP([1, 2, 3, 4])
+    fetch = imap.uid
+    
+    def failing_fetch(command, *args):
+        if command == 'FETCH' and args[0] == "3:4":
+            return 'NO', [b'connection lost']
+        return fetch(command, *args)
+    
+    imap.uid = failing_fetch
+    assert export(monkeypatch, imap, destination, batch_size=2)["status"] == "error"
+    assert subjects(destination) == [1, 2]
+    
+    imap.uid = fetch
+    assert export(monkeypatch, imap, destination, batch_size=2)["exported_count"] == 2
+    assert subjects(destination) == [1, 2, 3, 4]
+
+
+def test_destination_of_another_folder_is_refused(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    export(monkeypatch, ExportIMAP([1, 2]), destination)
+    
+    result = server.export_folder.fn("Archive", str(destination))
+    assert result["status"] == "error"
+    assert "'INBOX'" in result["message"]
+    assert subjects(destination) == [1, 2]
+
+
+def test_non_empty_destination_without_checkpoint_is_refused(monkeypatch, tmp_path):
+    destination = tmp_path / "inbox.mbox"
+    export(monkeypatch, ExportIMAP([1, 2]), destination)
+    (tmp_path / "inbox.mbox.checkpoint.json").unlink()
+    
+    for incremental in (True, False):
+        result = export(monkeypatch, ExportIMAP([1, 2]), destination, incremental=incremental)
+        assert result["status"] == "error"
+    assert subjects(destination) == [1, 2]
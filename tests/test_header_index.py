@@ -0,0 +1,30 @@
+import server
+from server import HeaderIndex
+
+
+class StatusOnlyIMAP:
+    """Answers STATUS and fails the test on any other command"""
+    
+    capabilities = ('IMAP4REV1', 'CONDSTORE')
+    
+    def __init__(self, status_line):
+        self.status_line = status_line
+    
+    def status(self, folder, items):
+        return 'OK', [self.status_line]
+    
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected IMAP command {name}")
+
+
+def test_folder_status_parses_items_after_folder_name():
+    imap = StatusOnlyIMAP(b'"Work (old)" (MESSAGES 12 UIDVALIDITY 3 HIGHESTMODSEQ 90210)')
+    status = server._get_folder_status(imap, '"Work (old)"', '(MESSAGES UIDVALIDITY HIGHESTMODSEQ)')
+    assert status == {"MESSAGES": 12, "UIDVALIDITY": 3, "HIGHESTMODSEQ": 90210}
+
+
+def test_unchanged_folder_is_not_selected(tmp_path):
+    index = HeaderIndex(str(tmp_path))
+    index.folder_state["INBOX"] = {"uidvalidity": 3, "last_uid": 40, "messages": 12, "highestmodseq": 90210, "updated": 0}
+    imap = StatusOnlyIMAP(b'"INBOX" (MESSAGES 12 UIDVALIDITY 3 HIGHESTMODSEQ 90210)')
+    assert index.refresh_folder(imap, "INBOX") == 0
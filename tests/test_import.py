@@ -0,0 +1,229 @@
+import imaplib
+import mailbox
+import re
+import socket
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import server
+
+
+class ScriptedServer:
+    """IMAP server on one end of a socketpair that records every command it receives.
+    
+    APPEND commands are answered by reply(command), which returns the tagged status
+    such as b"OK" or b"NO", or None to drop the connection.
+    """
+    
+    def __init__(self, capabilities, reply=lambda command: b"OK"):
+        self.capabilities = capabilities
+        self.reply = reply
+        self.commands = []
+        self.client, self.sock = socket.socketpair()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+    
+    def read_command(self, reader):
+        line = reader.readline()
+        command = line
+        while True:
+            literal = re.search(rb'\{(\d+)(\+?)\}\r\n$', line)
+            if not literal:
+                return command
+            if not literal.group(2):
+                self.sock.sendall(b'+ go ahead\r\n')
+            command += reader.read(int(literal.group(1)))
+            line = reader.readline()
+            command += line
+    
+    def serve(self):
+        reader = self.sock.makefile('rb')
+        self.sock.sendall(b'* OK ready\r\n')
+        while True:
+            command = self.read_command(reader)
+            if not command:
+                break
+            tag, name = command.rstrip().split(b' ', 2)[:2]
+            if name == b'CAPABILITY':
+                self.sock.sendall(b'* CAPABILITY IMAP4rev1 ' + self.capabilities + b'\r\n' + tag + b' OK done\r\n')
+                continue
+            self.commands.append(command[len(tag) + 1:])
+            status = self.reply(command) if name == b'APPEND' else b"OK"
+            if status is None:
+                break
+            self.sock.sendall(tag + b' ' + status + b' done\r\n')
+        self.sock.close()
+
+
+class SocketIMAP(imaplib.IMAP4):
+    """imaplib client talking to a ScriptedServer instead of a network socket"""
+    
+    def __init__(self, scripted):
+        self.scripted = scripted
+        super().__init__()
+        self.state = 'AUTH'
+    
+    def open(self, host='', port=imaplib.IMAP4_PORT, timeout=None):
+        self.host = host
+        self.port = port
+        self.sock = self.scripted.client
+        self.file = self.sock.makefile('rb')
+
+
+def connect(capabilities, reply=lambda command: b"OK"):
+    scripted = ScriptedServer(capabilities, reply)
+    return scripted, SocketIMAP(scripted)
+
+
+INTERNALDATE = 1700000000
+DATE = imaplib.Time2Internaldate(INTERNALDATE).encode()
+BATCH = [("\\Seen", INTERNALDATE, b"Subject: one\n\nbody\n"), ("", INTERNALDATE, b"Subject: two\r\n\r\nbody\r\n")]
+LITERALS = [b"Subject: one\r\n\r\nbody\r\n", b"Subject: two\r\n\r\nbody\r\n"]
+
+
+def test_append_without_literal_plus_uses_synchronizing_literals():
+    scripted, imap = connect(b'UIDPLUS')
+    assert server._append_messages(imap, "INBOX", BATCH) == [True, True]
+    assert scripted.commands == [
+        b'APPEND INBOX (\\Seen) ' + DATE + b' {%d}\r\n' % len(LITERALS[0]) + LITERALS[0] + b'\r\n',
+        b'APPEND INBOX ' + DATE + b' {%d}\r\n' % len(LITERALS[1]) + LITERALS[1] + b'\r\n',
+    ]
+
+
+def test_append_with_literal_plus_pipelines_one_append_per_message():
+    scripted, imap = connect(b'LITERAL+', reply=lambda command: b"NO" if b"two" in command else b"OK")
+    assert server._append_messages(imap, "INBOX", BATCH) == [True, False]
+    assert scripted.commands == [
+        b'APPEND INBOX (\\Seen) ' + DATE + b' {%d+}\r\n' % len(LITERALS[0]) + LITERALS[0] + b'\r\n',
+        b'APPEND INBOX () ' + DATE + b' {%d+}\r\n' % len(LITERALS[1]) + LITERALS[1] + b'\r\n',
+    ]
+
+
+def test_multiappend_sends_the_batch_as_one_command():
+    scripted, imap = connect(b'LITERAL+ MULTIAPPEND')
+    assert server._append_messages(imap, "INBOX", BATCH) == [True, True]
+    assert scripted.commands == [
+        b'APPEND INBOX (\\Seen) ' + DATE + b' {%d+}\r\n' % len(LITERALS[0]) + LITERALS[0]
+        + b' () ' + DATE + b' {%d+}\r\n' % len(LITERALS[1]) + LITERALS[1] + b'\r\n',
+    ]
+
+
+def test_failed_multiappend_is_retried_one_message_at_a_time():
+    scripted, imap = connect(b'LITERAL+ MULTIAPPEND', reply=lambda command: b"NO" if b"two" in command else b"OK")
+    batch = BATCH + [("", INTERNALDATE, b"Subject: three\r\n\r\nbody\r\n")]
+    assert server._append_messages(imap, "INBOX", batch) == [True, False, True]
+    assert len(scripted.commands) == 4
+    assert scripted.commands[1] == b'APPEND INBOX (\\Seen) ' + DATE + b' {%d+}\r\n' % len(LITERALS[0]) + LITERALS[0] + b'\r\n'
+    for name, command in zip((b"one", b"two", b"three"), scripted.commands[1:]):
+        assert b"Subject: " + name in command
+
+
+def test_dropped_connection_aborts_the_pipelined_batch():
+    _, imap = connect(b'LITERAL+ MULTIAPPEND', reply=lambda command: None)
+    batch = [("", 1700000000, b"Subject: one\r\n\r\nbody\r\n"), ("", 1700000000, b"Subject: two\r\n\r\nbody\r\n")]
+    sent = []
+    command = imap._command
+    imap._command = lambda name, *args: (sent.append(name), command(name, *args))[1]
+    with pytest.raises(imaplib.IMAP4.abort):
+        server._append_messages(imap, "INBOX", batch)
+    # No message-by-message retry on the dead connection
+    assert sent == ['APPEND']
+
+
+class FolderIMAP:
+    """Folder without LITERAL+ that stores appended messages and serves their headers"""
+    
+    capabilities = ('IMAP4REV1',)
+    
+    def __init__(self):
+        self.appended = []
+    
+    def select(self, folder, readonly=False):
+        return 'OK', [str(len(self.appended)).encode()]
+    
+    def uid(self, command, *args):
+        uids = range(1, len(self.appended) + 1)
+        if command == 'SEARCH':
+            return 'OK', [" ".join(str(uid) for uid in uids).encode()]
+        response = []
+        for uid in server._parse_uid_set(args[0]):
+            header = self.appended[uid - 1][1].split(b'\r\n\r\n')[0] + b'\r\n\r\n'
+            response += [(f'{uid} (UID {uid} BODY[HEADER.FIELDS (...)] {{{len(header)}}}'.encode(), header), b')']
+        return 'OK', response
+    
+    def append(self, folder, flags, date_time, raw):
+        self.appended.append((flags, raw))
+        return 'OK', [b'done']
+
+
+class ImportManager:
+    name = "default"
+    
+    def __init__(self, imap):
+        self.connection = imap
+    
+    @contextmanager
+    def imap(self, priority=server.PRIORITY_INTERACTIVE):
+        yield self.connection
+
+
+def write_mbox(path, messages):
+    with open(path, 'wb') as f:
+        for raw in messages:
+            f.write(b'From sender@x.com Mon Jan  1 10:00:00 2024\n' + raw + b'\n')
+
+
+def test_strip_mbox_artifacts():
+    raw = (b"Subject: hi\nStatus: RO\nX-Status: F\n  folded\nFrom: a@x.com\n\n"
+           b">From the start\n>>From quoted twice\nStatus: in the body\n")
+    assert server._strip_mbox_artifacts(raw) == (
+        b"Subject: hi\nFrom: a@x.com\n\nFrom the start\n>From quoted twice\nStatus: in the body\n"
+    )
+
+
+def test_mbox_import_uploads_flags_without_mbox_headers(monkeypatch, tmp_path):
+    source = tmp_path / "source.mbox"
+    write_mbox(source, [b"From: a@x.com\nSubject: one\nMessage-ID: <1@x>\nStatus: RO\nX-Status: F\n\n>From here\n"])
+    imap = FolderIMAP()
+    monkeypatch.setattr(server, "_get_manager", lambda account: ImportManager(imap))
+    
+    result = server.import_messages.fn(str(source))
+    assert result["imported_count"] == 1
+    flags, raw = imap.appended[0]
+    assert flags.split() == ["\\Flagged", "\\Seen"]
+    assert b"Status:" not in raw
+    assert b"\nFrom here" in raw
+
+
+def test_rerun_skips_messages_without_message_id(monkeypatch, tmp_path):
+    source = tmp_path / "source.mbox"
+    write_mbox(source, [
+        b"From: a@x.com\nSubject: with id\nMessage-ID: <1@x>\n\nbody\n",
+        b"From: a@x.com\nSubject: without id\nDate: Mon, 1 Jan 2024 10:00:00 +0000\n\nbody\n",
+    ])
+    imap = FolderIMAP()
+    monkeypatch.setattr(server, "_get_manager", lambda account: ImportManager(imap))
+    
+    assert server.import_messages.fn(str(source))["imported_count"] == 2
+    result = server.import_messages.fn(str(source))
+    assert result["imported_count"] == 0
+    assert result["skipped_duplicates"] == 2
+    assert len(imap.appended) == 2
+
+
+def test_source_is_closed_when_the_import_fails(monkeypatch, tmp_path):
+    source = tmp_path / "source.mbox"
+    write_mbox(source, [b"From: a@x.com\nSubject: one\n\nbody\n"])
+    closed = []
+    close = mailbox.mbox.close
+    monkeypatch.setattr(mailbox.mbox, "close", lambda box: (closed.append(True), close(box)))
+    
+    def unknown_account(account):
+        raise Exception(f"Unknown account '{account}'")
+    
+    monkeypatch.setattr(server, "_get_manager", unknown_account)
+    
+    assert server.import_messages.fn(str(source))["status"] == "error"
+    assert closed == [True]
@@ -0,0 +1,88 @@
+import pytest
+
+import server
+from server import OfflineStore
+
+
+def synced_store(tmp_path):
+    """Store with INBOX (UIDs 10-12, UIDVALIDITY 7) and Archive (UID 5, UIDVALIDITY 3) synced"""
+    store = OfflineStore(str(tmp_path / "offline.sqlite3"))
+    store.apply_sync("INBOX", 7, 100, 10, [10, 11, 12], {10: [], 11: ["\\Seen"], 12: []}, set())
+    store.apply_sync("Archive", 3, 50, 10, [5], {5: []}, set())
+    return store
+
+
+def journal_entry(entry_id, action, uids, argument, folder="INBOX", modseq=100):
+    return {"id": entry_id, "action": action, "folder": folder, "uidvalidity": 7, "modseq": modseq, "uids": uids, "argument": argument}
+
+
+def test_parse_sequence_set():
+    assert server._parse_sequence_set("3", 5) == [3]
+    assert server._parse_sequence_set("1, 4", 5) == [1, 4]
+    assert server._parse_sequence_set("4:2", 5) == [2, 3, 4]
+    assert server._parse_sequence_set("2:*,1", 3) == [1, 2, 3]
+    with pytest.raises(Exception):
+        server._parse_sequence_set("6", 5)
+
+
+def test_set_flags_changes_rows_and_journals_uids(tmp_path):
+    store = synced_store(tmp_path)
+    assert store.set_flags("INBOX", "1,3", add=["\\Flagged"], remove=["\\Seen"]) == 2
+    
+    assert [flags for _, flags, _ in store.messages("INBOX", "1:3")] == [["\\Flagged"], ["\\Seen"], ["\\Flagged"]]
+    entries = store.journal_entries()
+    assert len(entries) == 1
+    assert entries[0]["action"] == "flags"
+    assert entries[0]["folder"] == "INBOX"
+    assert entries[0]["uidvalidity"] == 7
+    assert entries[0]["modseq"] == 100
+    assert entries[0]["uids"] == [10, 12]
+    assert store.pending_changes() == 1
+
+
+def test_changes_after_an_offline_move_are_journaled_against_the_origin(tmp_path):
+    store = synced_store(tmp_path)
+    assert store.move("INBOX", "1", "Archive") == 1
+    
+    # The moved message is listed last in Archive with a temporary UID
+    assert len(store.messages("INBOX", "1:*")) == 2
+    with store.lock:
+        rows = store._resolve(store._db(), "Archive", "2")
+    assert rows[0][1] == 6
+    assert rows[0][4:] == ("INBOX", 10, 7)
+    
+    store.set_flags("Archive", "2", add=["\\Seen"])
+    entries = store.journal_entries()
+    assert [(entry["action"], entry["folder"], entry["uids"]) for entry in entries] == [
+        ("move", "INBOX", [10]),
+        ("flags", "INBOX", [10])
+    ]
+
+
+def test_move_to_unsynced_folder_drops_the_row(tmp_path):
+    store = synced_store(tmp_path)
+    store.move("INBOX", "2", "Receipts")
+    assert len(store.messages("INBOX", "1:*")) == 2
+    assert store.journal_entries()[0]["argument"] == {"destination": "Receipts"}
+
+
+def test_fold_journal_keeps_only_the_net_change():
+    folded = server._fold_journal([
+        journal_entry(1, "flags", [10, 11], {"add": ["\\Seen"], "remove": []}),
+        journal_entry(2, "flags", [10], {"add": [], "remove": ["\\Seen"]}, modseq=90),
+        journal_entry(3, "move", [11], {"destination": "Archive"}),
+    ])
+    
+    changes = folded[("INBOX", 7)]
+    assert changes["entry_ids"] == [1, 2, 3]
+    assert changes["modseq"] == 90
+    assert changes["messages"][10] == {"flags": {"\\Seen": False}, "destination": None}
+    assert changes["messages"][11] == {"flags": {"\\Seen": True}, "destination": "Archive"}
+
+
+def test_fold_journal_cancels_a_move_back_to_the_origin():
+    folded = server._fold_journal([
+        journal_entry(1, "move", [10], {"destination": "Archive"}),
+        journal_entry(2, "move", [10], {"destination": "INBOX"}),
+    ])
+    assert folded[("INBOX", 7)]["messages"][10]["destination"] is None
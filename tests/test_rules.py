@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+
+import pytest
+
+import server
+from server import _compile_rule_match
+
+
+class RulesIMAP:
+    """Answers SEARCH from a fixed table of criteria and records every STORE"""
+    
+    def __init__(self, searches):
+        self.searches = searches
+        self.stores = []
+    
+    def select(self, folder, readonly=False):
+        return 'OK', [b'3']
+    
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            return 'OK', [" ".join(str(uid) for uid in self.searches[args[0]]).encode()]
+        self.stores.append(args)
+        return 'OK', [None]
+
+
+class RulesManager:
+    def __init__(self, imap):
+        self.connection = imap
+    
+    @contextmanager
+    def imap(self, priority=server.PRIORITY_INTERACTIVE):
+        yield self.connection
+
+
+def test_ascii_conditions_are_pushed_to_search():
+    criteria, local_checks = _compile_rule_match({
+        "from": "news@",
+        "subject": 'say "hi"',
+        "unread": True,
+        "flagged": False,
+        "since": "2024-03-05",
+        "larger_than": 1000
+    })
+    assert criteria == 'FROM "news@" SUBJECT "say \\"hi\\"" UNSEEN UNFLAGGED SINCE 5-Mar-2024 LARGER 1000'
+    assert local_checks == []
+
+
+def test_empty_match_searches_all():
+    assert _compile_rule_match({}) == ("ALL", [])
+
+
+def test_regex_and_non_ascii_conditions_are_checked_locally():
+    criteria, local_checks = _compile_rule_match({
+        "subject_regex": r"^invoice \d+",
+        "from": "zoë@example.com",
+        "header": {"List-Id": "dev.example.com", "X-Tag": "ünicode"}
+    })
+    assert criteria == 'HEADER "List-Id" "dev.example.com"'
+    checks = dict(local_checks)
+    assert set(checks) == {"Subject", "From", "X-Tag"}
+    assert checks["Subject"]("Invoice 1234")
+    assert not checks["Subject"]("Re: invoice 1234")
+    assert checks["From"]("Zoë <ZOË@example.com>")
+    assert checks["X-Tag"]("tagged ÜNICODE")
+
+
+def test_non_ascii_body_and_unknown_conditions_are_rejected():
+    with pytest.raises(Exception, match="only supports ASCII"):
+        _compile_rule_match({"body": "grüße"})
+    with pytest.raises(Exception, match="Unknown rule condition 'bogus'"):
+        _compile_rule_match({"bogus": 1})
+
+
+def test_line_breaks_are_never_sent_to_the_server():
+    criteria, local_checks = _compile_rule_match({
+        "subject": "x\r\nA001 DELETE INBOX",
+        "header": {"X-Tag": "a\nb", "List-Id": "nul\0byte"}
+    })
+    assert criteria == "ALL"
+    assert [name for name, _ in local_checks] == ["Subject", "X-Tag", "List-Id"]
+    with pytest.raises(Exception, match="without line breaks"):
+        _compile_rule_match({"text": "x\r\nA001 DELETE INBOX"})
+
+
+def test_invalid_header_names_are_rejected():
+    for name in ("X-Tag\r\nA001 DELETE INBOX", "X Tag", "X-Tag:", "Täg"):
+        with pytest.raises(Exception, match="Invalid header name"):
+            _compile_rule_match({"header": {name: "value"}})
+
+
+def test_later_rules_win_conflicting_flag_actions(monkeypatch):
+    imap = RulesIMAP({'FROM "a@"': [1], 'FROM "b@"': [2], 'SUBJECT "b"': [2]})
+    monkeypatch.setattr(server, "_get_manager", lambda account: RulesManager(imap))
+    result = server.apply_rules.fn([
+        {"match": {"from": "a@"}, "actions": {"mark_read": True}},
+        {"match": {"from": "b@"}, "actions": {"mark_read": False}},
+        {"match": {"subject": "b"}, "actions": {"mark_read": True}}
+    ])
+    
+    assert result["status"] == "success"
+    assert imap.stores == [('1:2', '+FLAGS.SILENT', '(\\Seen)')]
+    assert result["changes"]["marked_read"] == 2
+    assert result["changes"]["marked_unread"] == 0
@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+import server
+from server import PRIORITY_BULK, PRIORITY_INTERACTIVE, RequestScheduler
+
+
+def acquire_within(scheduler, priority, timeout=3.0):
+    """Run acquire_command in a thread and report whether it returned in time"""
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (scheduler.acquire_command(priority), done.set()), daemon=True)
+    thread.start()
+    return done.wait(timeout)
+
+
+def test_bulk_command_after_repeated_throttling():
+    scheduler = RequestScheduler(2, 10)
+    for _ in range(5):
+        scheduler.on_throttle()
+    scheduler.resume_at = 0.0
+    assert scheduler.command_rate == 1.0
+    assert acquire_within(scheduler, PRIORITY_BULK)
+
+
+def test_bulk_command_with_low_configured_rate():
+    scheduler = RequestScheduler(2, 1)
+    assert acquire_within(scheduler, PRIORITY_BULK)
+
+
+def test_bulk_leaves_reserve_for_interactive():
+    scheduler = RequestScheduler(2, 10)
+    scheduler.tokens = 2.5
+    scheduler.tokens_updated = time.monotonic()
+    # A bulk command needs 1 token plus a reserve of 2, an interactive one only 1
+    assert not acquire_within(scheduler, PRIORITY_BULK, timeout=0.0)
+    assert acquire_within(scheduler, PRIORITY_INTERACTIVE)
+
+
+def test_throttle_halves_limits_and_success_restores_them():
+    scheduler = RequestScheduler(4, 8)
+    scheduler.concurrency = 4.0
+    scheduler.on_throttle()
+    assert scheduler.concurrency == 2.0
+    assert scheduler.command_rate == 4.0
+    assert scheduler.resume_at > time.monotonic()
+    for _ in range(100):
+        scheduler.on_success()
+    assert scheduler.concurrency == 4.0
+    assert scheduler.command_rate == 8.0
+
+
+def test_interactive_sessions_overtake_queued_bulk_sessions():
+    scheduler = RequestScheduler(1, 100)
+    order = []
+    
+    def session(priority, name, duration=0.01):
+        with scheduler.slot(priority):
+            order.append(name)
+            time.sleep(duration)
+    
+    threads = [threading.Thread(target=session, args=(PRIORITY_BULK, "bulk-running", 0.2))]
+    threads[0].start()
+    time.sleep(0.01)
+    for priority, name in [(PRIORITY_BULK, "bulk-queued"), (PRIORITY_INTERACTIVE, "interactive")]:
+        thread = threading.Thread(target=session, args=(priority, name))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == ["bulk-running", "interactive", "bulk-queued"]
+
+
+def test_call_retries_throttled_operations(monkeypatch):
+    monkeypatch.setattr(server, "THROTTLE_BASE_BACKOFF", 0.01)
+    scheduler = RequestScheduler(2, 100)
+    attempts = []
+    
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise server.imaplib.IMAP4.error("NO [UNAVAILABLE] try again later")
+        return "ok"
+    
+    assert scheduler.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert scheduler.throttle_events == 2
+
+
+def test_bulk_sessions_leave_a_slot_for_interactive():
+    scheduler = RequestScheduler(3, 100)
+    scheduler.concurrency = 3.0
+    release = threading.Event()
+    started = []
+    
+    def session(priority, name):
+        with scheduler.slot(priority):
+            started.append(name)
+            release.wait(3.0)
+    
+    threads = [threading.Thread(target=session, args=(PRIORITY_BULK, f"bulk-{i}"), daemon=True) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    assert len(started) == 2
+    assert scheduler.active_bulk == 2
+    
+    interactive = threading.Thread(target=session, args=(PRIORITY_INTERACTIVE, "interactive"), daemon=True)
+    interactive.start()
+    time.sleep(0.1)
+    assert "interactive" in started
+    assert len(started) == 3
+    
+    release.set()
+    for thread in threads + [interactive]:
+        thread.join()
+    assert len(started) == 4
+
+
+def test_single_slot_still_admits_bulk():
+    scheduler = RequestScheduler(1, 100)
+    with scheduler.slot(PRIORITY_BULK):
+        assert scheduler.active_bulk == 1
+
+
+def test_only_aborts_with_throttle_text_count_as_throttling():
+    assert not server._is_throttle_error(server.imaplib.IMAP4.abort("socket error: EOF"))
+    assert server._is_throttle_error(server.imaplib.IMAP4.abort("BYE [UNAVAILABLE] Server busy"))
+
+
+def test_dropped_connection_is_not_counted_as_throttling(monkeypatch):
+    def dropped(self, name, *args):
+        raise server.imaplib.IMAP4.abort("socket error: EOF")
+    
+    monkeypatch.setattr(server.imaplib.IMAP4_SSL, "_simple_command", dropped)
+    connection = object.__new__(server.ScheduledIMAP4_SSL)
+    connection.scheduler = RequestScheduler(2, 100)
+    with pytest.raises(server.imaplib.IMAP4.abort):
+        connection._simple_command("NOOP")
+    assert connection.scheduler.throttle_events == 0
+
+
+def test_throttled_login_is_counted_once(monkeypatch):
+    def throttled(self, name, *args):
+        return 'NO', [b'[UNAVAILABLE] Too many connections']
+    
+    monkeypatch.setattr(server.imaplib.IMAP4_SSL, "_simple_command", throttled)
+    scheduler = RequestScheduler(4, 8)
+    scheduler.concurrency = 4.0
+    connection = object.__new__(server.ScheduledIMAP4_SSL)
+    connection.scheduler = scheduler
+    with pytest.raises(server.imaplib.IMAP4.error):
+        scheduler.call(lambda: connection.login("user", "password"), retries=0)
+    assert scheduler.throttle_events == 1
+    assert scheduler.concurrency == 2.0
+    assert scheduler.command_rate == 4.0
@@ -0,0 +1,14 @@
+from server import _uid_set
+
+
+def test_uid_set_compresses_runs():
+    assert _uid_set([1, 2, 3, 4, 5, 9, 12, 13, 14]) == "1:5,9,12:14"
+
+
+def test_uid_set_sorts_and_deduplicates():
+    assert _uid_set([7, 3, 4, 3, 8]) == "3:4,7:8"
+
+
+def test_uid_set_single_and_empty():
+    assert _uid_set([42]) == "42"
+    assert _uid_set([]) == ""